@@ -16,15 +16,31 @@
 #
 """Functions for various processing purposes"""
 from docria.model import Document, Node, NodeLayerCollection, DataTypeEnum, TextSpan, Text, TextSpan
-from typing import Set, List, Callable, Tuple, Dict, Optional, Iterator, Iterable, Any
-from collections import deque, namedtuple, defaultdict
+from typing import Set, List, Callable, Tuple, Dict, Optional, Iterator, Iterable, Any, Union
+from collections import namedtuple, defaultdict
 import functools
+import threading
+import weakref
+from concurrent.futures import Executor
+from operator import itemgetter
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, count, repeat
+from heapq import heappush, heappop
 
 
 def get_prop(prop, default=None):
     """First order function which can be used to extract property of nodes"""
+    try:
+        return _get_prop(prop, default)
+    except TypeError:
+        # Unhashable default, can not be memoized
+        return _get_prop.__wrapped__(prop, default)
+
+
+@functools.lru_cache(maxsize=1024, typed=True)
+def _get_prop(prop, default):
     def get(n: Node):
-        return default if prop not in n else n[prop]
+        return n.get(prop, default)
 
     return get
 
@@ -45,25 +61,37 @@ def children_of(layer: NodeLayerCollection, *props):
     Note: the code will check against schema if it is an array or single node."""
     def node_iter(prop):
         def yielder(n: Node):
-            if prop in n:
-                yield n[prop]
+            child = n.get(prop)
+            if child is not None:
+                return child,
+            else:
+                return ()
 
         return yielder
 
     def node_array_iter(prop):
         def yielder(n: Node):
-            if prop in n:
-                return iter(n[prop])
+            children = n.get(prop)
+            if children is not None:
+                # A copy, callers must not be able to modify the stored list
+                return tuple(children)
             else:
-                return iter(()) # Empty iterator
+                return ()
 
         return yielder
 
-    def compose(yielders):
+    def compose(fields):
         def yielder(n: Node):
-            for yielder in yielders:
-                for n in yielder(n):
-                    yield n
+            result = []
+            for prop, many in fields:
+                value = n.get(prop)
+                if value is not None:
+                    if many:
+                        result.extend(value)
+                    else:
+                        result.append(value)
+
+            return result
 
         return yielder
 
@@ -79,85 +107,247 @@ def children_of(layer: NodeLayerCollection, *props):
             )
 
     elif len(props) > 1:
-        yielders = []
+        fields = []  # type: List[Tuple[str, bool]]
         for prop in props:
             typedef = layer.schema.fields[prop]
             if typedef.typename == DataTypeEnum.NODEREF:
-                yielders.append(node_iter(prop))
+                fields.append((prop, False))
             elif typedef.typename == DataTypeEnum.NODEREF_MANY:
-                yielders.append(node_array_iter(prop))
+                fields.append((prop, True))
             else:
                 raise ValueError("field %s has type %s which is not supported as a children type" % (
                     prop, repr(typedef))
                 )
 
-        return compose(yielders)
+        return compose(fields)
     else:
         raise ValueError("props has to contain at least one property!")
 
 
+def children_of_precomputed(layer: NodeLayerCollection, *props):
+    """Get children of the given properties like :func:`children_of`, resolved once for all nodes in the layer.
+
+    Useful when the same layer is traversed many times. The result is a snapshot: a lookup raises ValueError
+    if nodes have been added, removed or reordered since, changes to the children fields are not detected."""
+    children = children_of(layer, *props)
+    nodes = list(layer._nodes)
+    num = layer.num
+    adjacency = [tuple(children(n)) if n is not None else None for n in nodes]
+
+    def lookup(n: Node):
+        if n.collection is layer:
+            i = n._id
+            if layer.num != num or i >= len(nodes) or nodes[i] is not n:
+                raise ValueError("Precomputed children of layer %s are stale, "
+                                 "nodes have been added, removed or reordered." % layer.name)
+
+            return adjacency[i]
+        else:
+            return children(n)
+
+    return lookup
+
+
+class _VisitMarks:
+    """
+    Visited marks indexed by _id for the nodes of a layer, reused across traversals of that layer.
+
+    A node is visited when its byte equals the current mark, the bytes are only cleared once all 255 marks are used.
+    """
+    __slots__ = ("seen", "mark")
+
+    def __init__(self, size: int):
+        self.seen = bytearray(size)
+        self.mark = 0
+
+    def next_mark(self)->int:
+        if self.mark == 255:
+            self.seen = bytearray(len(self.seen))
+            self.mark = 0
+
+        self.mark += 1
+        return self.mark
+
+
+_NO_LAYER = object()
+_marks_pool = threading.local()  # per thread, free: WeakKeyDictionary of layer -> List[_VisitMarks]
+
+
+def _free_marks()->"weakref.WeakKeyDictionary":
+    """Free marks of the calling thread, keyed by layer."""
+    free = getattr(_marks_pool, "free", None)
+    if free is None:
+        free = _marks_pool.free = weakref.WeakKeyDictionary()
+
+    return free
+
+
+def _acquire_marks(node: Node)->Tuple[Any, _VisitMarks]:
+    """Lease visited marks for the layer of node, returns the layer the marks are valid for and the marks."""
+    layer = node.collection
+    if layer is None:
+        return _NO_LAYER, _VisitMarks(0)
+
+    free = _free_marks().get(layer)
+    if free:
+        marks = free.pop()
+        if len(marks.seen) >= len(layer._nodes):
+            marks.next_mark()
+            return layer, marks
+
+    marks = _VisitMarks(len(layer._nodes))
+    marks.next_mark()
+    return layer, marks
+
+
+def _grow_marks(seen: bytearray, layer: NodeLayerCollection):
+    """Extend seen in place to cover nodes added to the layer during a traversal, new bytes are unvisited."""
+    seen.extend(bytes(len(layer._nodes) - len(seen)))
+
+
+def _release_marks(layer, marks: _VisitMarks):
+    """Return leased marks, a few are kept per layer for the next traversal."""
+    if layer is not _NO_LAYER:
+        free = _free_marks().setdefault(layer, [])
+        if len(free) < 4:
+            free.append(marks)
+
+
+class _SerialExecutor:
+    """Executor stand-in which maps in the calling thread"""
+    @staticmethod
+    def map(fn, *iterables):
+        return map(fn, *iterables)
+
+
+_SERIAL = _SerialExecutor()
+
+
 def bfs(start: Node,
         children: Callable[[Node], Iterator[Node]],
-        is_result: Optional[Callable[[Node], bool]]=None)->Iterator[Tuple[int, Node]]:
+        is_result: Optional[Callable[[Node], bool]]=None,
+        max_depth: Optional[int]=None,
+        stop_after_match: bool=False,
+        executor: Optional[Executor]=None)->Iterator[Tuple[int, Node]]:
     """
     Breadth first search
 
     :param start: the start node
     :param children: function returning children iterator for given node
     :param is_result: optional, function indicating if node should be emitted, default is true for all.
+    :param max_depth: optional, the maximum depth to search, the start node is at depth 0.
+    :param stop_after_match: stop the search after the first emitted node.
+    :param executor: optional, expand the children of each level using executor.map, only worthwhile when children
+                     is slow and releases the GIL. children should return a list when used.
 
     :return iterator of found nodes with depth during search
     """
-    visited = set()
-    queue = deque()
-    queue.append((0, start))
-    while queue:
-        current_depth, current_node = queue.popleft()
-        if current_node in visited:
-            continue
-
-        visited.add(current_node)
-
-        if is_result and is_result(current_node):
-            yield current_depth, current_node
-        elif not is_result:
-            yield current_depth, current_node
-
-        for child in children(current_node):
-            if child not in visited:
-                queue.append((current_depth+1, child))
+    # Marking on enqueue keeps each node in the queue at most once and gives the same order as marking on visit.
+    layer, marks = _acquire_marks(start)
+    try:
+        seen, mark = marks.seen, marks.mark
+        visited = set()  # ids of enqueued nodes outside the start layer, Node hashing and equality are Python level
+        if start.collection is layer:
+            seen[start._id] = mark
+        else:
+            visited.add(id(start))
+
+        # Level by level, the depth is shared by all nodes of a level instead of stored per queued node.
+        current_depth = 0
+        level = [start]
+        while level:
+            for current_node in level:
+                if is_result is None or is_result(current_node):
+                    yield current_depth, current_node
+
+                    if stop_after_match:
+                        return
+
+            if max_depth is not None and current_depth >= max_depth:
+                break
+
+            # The children of a level are independent of each other and can be expanded concurrently,
+            # results are consumed in level order which keeps the search order.
+            next_level = []
+            for child_nodes in (executor or _SERIAL).map(children, level):
+                for child in child_nodes:
+                    if child.collection is layer:
+                        i = child._id
+                        if i >= len(seen):
+                            _grow_marks(seen, layer)  # children added nodes to the layer
+                        elif seen[i] == mark:
+                            continue
+
+                        seen[i] = mark
+                    elif id(child) in visited:
+                        continue
+                    else:
+                        visited.add(id(child))
+
+                    next_level.append(child)
+
+            level = next_level
+            current_depth += 1
+    finally:
+        _release_marks(layer, marks)
 
 
 def dfs(start: Node,
         children: Callable[[Node], Iterator[Node]],
-        is_result: Optional[Callable[[Node], bool]]=None)->Iterator[Node]:
+        is_result: Optional[Callable[[Node], bool]]=None,
+        max_depth: Optional[int]=None,
+        stop_after_match: bool=False)->Iterator[Node]:
     """
     Depth first search
 
     :param start: start node
     :param children: function returning children iterator for given node
     :param is_result: optional, function indicating if node should be emitted, default is true for all.
+    :param max_depth: optional, the maximum depth along the search path, the start node is at depth 0.
+                      A node first reached deeper than max_depth is not visited through a shorter path later.
+    :param stop_after_match: stop the search after the first emitted node.
 
     :return iterator of nodes found during search
     """
-    visited = set()
-    stack = list()
-    stack.append(start)
+    layer, marks = _acquire_marks(start)
+    try:
+        seen, mark = marks.seen, marks.mark
+        visited = set()  # ids of visited nodes outside the start layer, Node hashing and equality are Python level
+        stack = list()
+        stack.append(start)
+        depths = [0] if max_depth is not None else None  # depth of each node in stack, only tracked when limited
+
+        while stack:
+            current = stack.pop()
+            current_depth = depths.pop() if depths is not None else 0
+            if current.collection is layer:
+                i = current._id
+                if i >= len(seen):
+                    _grow_marks(seen, layer)  # children added nodes to the layer
+                elif seen[i] == mark:
+                    continue
+
+                seen[i] = mark
+            elif id(current) in visited:
+                continue
+            else:
+                visited.add(id(current))
 
-    while stack:
-        current = stack.pop()
-        if current in visited:
-            continue
+            if is_result is None or is_result(current):
+                yield current
 
-        visited.add(current)
-        if is_result and is_result(current):
-            yield current
-        elif not is_result:
-            yield current
+                if stop_after_match:
+                    return
 
-        child_nodes = [ch for ch in children(current) if ch not in visited]
-        child_nodes.reverse()
-        stack.extend(child_nodes)
+            # Visited children are skipped when popped, reversed keeps the left to right order.
+            if depths is None:
+                stack.extend(reversed(list(children(current))))
+            elif current_depth < max_depth:
+                child_nodes = list(children(current))
+                stack.extend(reversed(child_nodes))
+                depths.extend(repeat(current_depth+1, len(child_nodes)))
+    finally:
+        _release_marks(layer, marks)
 
 
 def dfs_leaves(start: Node,
@@ -172,26 +362,322 @@ def dfs_leaves(start: Node,
 
     :return iterator of nodes found during search
     """
-    visited = set()
-    stack = list()
-    stack.append(start)
+    layer, marks = _acquire_marks(start)
+    try:
+        seen, mark = marks.seen, marks.mark
+        visited = set()  # ids of visited nodes outside the start layer, Node hashing and equality are Python level
+        stack = list()
+        stack.append(start)
+
+        while stack:
+            current = stack.pop()
+            if current.collection is layer:
+                i = current._id
+                if i >= len(seen):
+                    _grow_marks(seen, layer)  # children added nodes to the layer
+                elif seen[i] == mark:
+                    continue
+
+                seen[i] = mark
+            elif id(current) in visited:
+                continue
+            else:
+                visited.add(id(current))
+
+            child_nodes = [ch for ch in children(current)
+                           if not (ch._id < len(seen) and seen[ch._id] == mark if ch.collection is layer
+                                   else id(ch) in visited)]
+
+            if not child_nodes and (is_result is None or is_result(current)):
+                yield current
+
+            stack.extend(reversed(child_nodes))
+    finally:
+        _release_marks(layer, marks)
+
+
+def bidirectional_bfs(source: Node,
+                      target: Node,
+                      children: Callable[[Node], Iterator[Node]],
+                      parents: Callable[[Node], Iterator[Node]])->Optional[List[Node]]:
+    """
+    Shortest path between two nodes, by breadth first search from both ends.
+
+    The smaller frontier is expanded one level at a time, and the search stops when the frontiers meet.
+
+    :param source: the start node
+    :param target: the node to find a path to
+    :param children: function returning children iterator for given node
+    :param parents: function returning the nodes which have given node as a child, the reverse of children.
+                    For undirected graphs, pass children again.
+
+    :return list of nodes from source to target, or None if target is not reachable
+    """
+    if source is target:
+        return [source]
+
+    # id(node) -> the next node towards source or target, Node hashing and equality are Python level
+    pred = {id(source): None}  # type: Dict[int, Optional[Node]]
+    succ = {id(target): None}  # type: Dict[int, Optional[Node]]
+    forward = [source]
+    backward = [target]
+
+    meeting = None
+    while forward and backward and meeting is None:
+        if len(forward) <= len(backward):
+            level, forward = forward, []
+            for node in level:
+                for child in children(node):
+                    if id(child) not in pred:
+                        pred[id(child)] = node
+                        forward.append(child)
+
+                        if id(child) in succ:
+                            meeting = child
+                            break
+
+                if meeting is not None:
+                    break
+        else:
+            level, backward = backward, []
+            for node in level:
+                for parent in parents(node):
+                    if id(parent) not in succ:
+                        succ[id(parent)] = node
+                        backward.append(parent)
+
+                        if id(parent) in pred:
+                            meeting = parent
+                            break
+
+                if meeting is not None:
+                    break
+
+    if meeting is None:
+        return None
+
+    # Only the path through the meeting node is materialized
+    return _path_through(meeting, pred, succ)
+
+
+def _path_through(meeting: Node, pred: Dict[int, Optional[Node]], succ: Dict[int, Optional[Node]])->List[Node]:
+    """Build the path through meeting, walking pred back to the source and succ forward to the target."""
+    path = []
+    node = meeting
+    while node is not None:
+        path.append(node)
+        node = pred[id(node)]
+
+    path.reverse()
+
+    node = succ[id(meeting)]
+    while node is not None:
+        path.append(node)
+        node = succ[id(node)]
+
+    return path
+
+
+def shortest_path(start: Node,
+                  target: Node,
+                  children: Callable[[Node], Iterator[Node]],
+                  cost: Optional[Callable[[Node, Node], float]]=None,
+                  parents: Optional[Callable[[Node], Iterator[Node]]]=None,
+                  heuristic: Optional[Callable[[Node], float]]=None)->Optional[List[Node]]:
+    """
+    Lowest cost path between two nodes.
 
-    while stack:
-        current = stack.pop()
-        if current in visited:
+    With parents and without heuristic, a bidirectional Dijkstra search which expands the smaller frontier,
+    without cost this is :func:`bidirectional_bfs`. Otherwise an A* search from start, i.e. Dijkstra without heuristic.
+
+    :param start: the start node
+    :param target: the node to find a path to
+    :param children: function returning children iterator for given node
+    :param cost: optional, function returning the non-negative cost of going from a node to one of its children,
+                 default is 1 for all.
+    :param parents: optional, function returning the nodes which have given node as a child, the reverse of children,
+                    enables bidirectional search. For undirected graphs, pass children again.
+    :param heuristic: optional, function returning an estimate of the cost from a node to target,
+                      must never overestimate the cost for the path to be the lowest cost path.
+
+    :return list of nodes from start to target, or None if target is not reachable
+    """
+    if cost is None:
+        if heuristic is None and parents is not None:
+            return bidirectional_bfs(start, target, children, parents)
+
+        def cost(u, v):
+            return 1
+
+    if heuristic is not None or parents is None:
+        # Only forward links are known, search from start alone
+        return _astar(start, target, children, cost, heuristic or (lambda n: 0))
+
+    if start is target:
+        return [start]
+
+    # Counter breaks ties in the heaps, Nodes are not comparable.
+    counter = count()
+
+    # Both directions: distances, links towards their end, heap of (distance, counter, node), settled ids.
+    dist = ({id(start): 0}, {id(target): 0})  # type: Tuple[Dict[int, float], Dict[int, float]]
+    links = ({id(start): None}, {id(target): None})  # type: Tuple[Dict[int, Optional[Node]], Dict[int, Optional[Node]]]
+    heaps = ([(0, next(counter), start)], [(0, next(counter), target)])
+    settled = (set(), set())  # type: Tuple[Set[int], Set[int]]
+
+    best = float("inf")
+    meeting = None
+    while heaps[0] and heaps[1]:
+        # No path through unsettled nodes can be cheaper than the best found
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+
+        direction = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        heap, own_dist, own_links, own_settled = heaps[direction], dist[direction], links[direction], settled[direction]
+        other_dist = dist[1-direction]
+
+        current_dist, _, current = heappop(heap)
+        if id(current) in own_settled:
+            continue
+
+        own_settled.add(id(current))
+
+        if direction == 0:
+            for child in children(current):
+                child_dist = current_dist + cost(current, child)
+                if child_dist < own_dist.get(id(child), best):
+                    own_dist[id(child)] = child_dist
+                    own_links[id(child)] = current
+                    heappush(heap, (child_dist, next(counter), child))
+
+                    if id(child) in other_dist and child_dist + other_dist[id(child)] < best:
+                        best = child_dist + other_dist[id(child)]
+                        meeting = child
+        else:
+            for parent in parents(current):
+                parent_dist = current_dist + cost(parent, current)
+                if parent_dist < own_dist.get(id(parent), best):
+                    own_dist[id(parent)] = parent_dist
+                    own_links[id(parent)] = current
+                    heappush(heap, (parent_dist, next(counter), parent))
+
+                    if id(parent) in other_dist and parent_dist + other_dist[id(parent)] < best:
+                        best = parent_dist + other_dist[id(parent)]
+                        meeting = parent
+
+    if meeting is None:
+        return None
+
+    return _path_through(meeting, links[0], links[1])
+
+
+def _astar(start: Node,
+           target: Node,
+           children: Callable[[Node], Iterator[Node]],
+           cost: Callable[[Node, Node], float],
+           heuristic: Callable[[Node], float])->Optional[List[Node]]:
+    """A* search from start to target, see :func:`shortest_path`"""
+    counter = count()
+    dist = {id(start): 0}  # type: Dict[int, float]
+    pred = {id(start): None}  # type: Dict[int, Optional[Node]]
+    heap = [(heuristic(start), next(counter), 0, start)]
+    settled = set()  # type: Set[int]
+
+    while heap:
+        _, _, current_dist, current = heappop(heap)
+        if current is target:
+            return _path_through(current, pred, {id(target): None})
+
+        if id(current) in settled:
             continue
 
-        visited.add(current)
+        settled.add(id(current))
 
-        child_nodes = [ch for ch in children(current) if ch not in visited]
-        child_nodes.reverse()
+        for child in children(current):
+            child_dist = current_dist + cost(current, child)
+            if id(child) not in dist or child_dist < dist[id(child)]:
+                dist[id(child)] = child_dist
+                pred[id(child)] = current
+                heappush(heap, (child_dist + heuristic(child), next(counter), child_dist, child))
 
-        if not child_nodes and is_result and is_result(current):
-            yield current
-        elif not child_nodes and not is_result:
-            yield current
+    return None
 
-        stack.extend(child_nodes)
+
+class SpanTranslator:
+    """
+    Translates source positions into target positions, an index over the intervals of a mapping layer.
+
+    Use :func:`build_span_translator` to construct, lookups are O(log N) in the number of mapping intervals.
+    """
+    def __init__(self, target_text: Text, starts: List[int], stops: List[int], target_starts: List[int]):
+        """
+        :param target_text: the text translated spans will refer to
+        :param starts: sorted source start positions of the mapping intervals
+        :param stops: source stop positions of the mapping intervals, exclusive
+        :param target_starts: target start positions of the mapping intervals
+        """
+        self.target_text = target_text
+        self.starts = starts
+        self.stops = stops
+        self.target_starts = target_starts
+
+    def find(self, position: int)->int:
+        """Find the target position of a source position."""
+        i = bisect_right(self.starts, position) - 1
+        if i < 0 or position >= self.stops[i]:
+            raise ValueError("Current position %d is outside any "
+                             "mapping interval, i.e. there is a gap in the mapping!" % position)
+
+        return (position - self.starts[i]) + self.target_starts[i]
+
+    def translate(self, span: TextSpan)->TextSpan:
+        """Translate a source span into the corresponding target span."""
+        start = self.find(span.start)
+        if span.stop > span.start:
+            return self.target_text[start:self.find(span.stop-1)+1]
+        else:
+            return self.target_text[start:start]
+
+
+def _validate_mapping(starts: List[int], stops: List[int]):
+    """Check that sorted mapping intervals do not overlap."""
+    if any(map(int.__gt__, stops, starts[1:])):
+        raise ValueError("Mapping which overlaps is not allowed!")
+
+
+def build_span_translator(doc: Document, mapping_layer: str, target_source_map: Tuple[str, str])->SpanTranslator:
+    """
+    Build a translator from a partial extraction to the original data, reusable across many layers.
+
+    Target is the original data, Source is the partial extraction ranges.
+
+    :param doc: document
+    :param mapping_layer: the layer which contains the mapping
+    :param target_source_map: tuple of (target field, source field)
+    """
+    target_pos, source_pos = target_source_map
+
+    mapping_layer = doc.layer[mapping_layer]
+    assert mapping_layer.schema.fields[target_pos].typename == DataTypeEnum.SPAN
+    assert mapping_layer.schema.fields[source_pos].typename == DataTypeEnum.SPAN
+
+    target_text = doc.texts[mapping_layer.schema.fields[target_pos].options["context"]]
+
+    # Empty mapping intervals can not contain any position and are left out.
+    intervals = []
+    for m in mapping_layer:
+        source_span = m[source_pos]
+        if source_span.start != source_span.stop:
+            intervals.append((source_span.start, source_span.stop, m[target_pos].start))
+
+    intervals.sort(key=itemgetter(0))
+
+    starts = [interval[0] for interval in intervals]
+    stops = [interval[1] for interval in intervals]
+    target_starts = [interval[2] for interval in intervals]
+
+    _validate_mapping(starts, stops)
+    return SpanTranslator(target_text, starts, stops, target_starts)
 
 
 def span_translate(doc: Document,
@@ -208,73 +694,17 @@ def span_translate(doc: Document,
     :param layer_remap: the layer which should be mapped
     :param source_target_remap: tuple of (source field, target field)
     """
-    target_pos, source_pos = target_source_map
     source_pos_remap, target_pos_remap = source_target_remap
 
-    mapping_layer = doc.layer[mapping_layer]
-    assert mapping_layer.schema.fields[target_pos].typename == DataTypeEnum.SPAN
-    assert mapping_layer.schema.fields[source_pos].typename == DataTypeEnum.SPAN
-
     layer_remap = doc.layer[layer_remap]
     assert layer_remap.schema.fields[source_pos_remap].typename == DataTypeEnum.SPAN
     assert layer_remap.schema.fields[target_pos_remap].typename == DataTypeEnum.SPAN
 
-    target_text = doc.texts[mapping_layer.schema.fields[target_pos].options["context"]]
-
-    # 1. Find start/end point interval intersections against mapping
-    # 1.1 Produce mapping array
-    mapping_in_source = []
-
-    for m in mapping_layer:
-        sourceStart = m[source_pos].start
-        sourceStop  = m[source_pos].stop
-
-        mapping_in_source.append(((sourceStart, 0), (0, m)))
-        mapping_in_source.append(((sourceStop, -1), (0, m)))
+    translate = build_span_translator(doc, mapping_layer, target_source_map).translate
 
     for n in layer_remap:
         if target_pos_remap not in n:
-            sourceRemapStart = n[source_pos_remap].start
-            sourceRemapStop = n[source_pos_remap].stop-1
-
-            mapping_in_source.append(((sourceRemapStart, 1), (1, n)))
-            mapping_in_source.append(((sourceRemapStop, 2), (1, n)))
-
-    mapping_in_source.sort(key=lambda tup: tup[0])
-
-    # 2. Translate points with relative distance from start in interval
-    remap_start_offsets = {}
-
-    active_interval_start = None
-    active_interval_target_start = None
-    for pos, source in mapping_in_source:
-        marker, markertype = pos
-        sourcetype, node = source
-
-        if sourcetype == 0:
-            if markertype == -1:
-                # End
-                active_interval_start = None
-                active_interval_target_start = None
-            elif markertype == 0:
-                assert active_interval_start is None, "Mapping which overlaps is not allowed!"
-                active_interval_start = marker
-                active_interval_target_start = node[target_pos].start
-            else:
-                assert False, "Bug! Should never happen."
-        elif sourcetype == 1:
-            assert active_interval_start is not None, "Current position %d is outside any " \
-                                                "mapping interval, i.e. there is a gap in the mapping!" % marker
-
-            if markertype == 1:
-                remap_start_offsets[node._id] = (marker - active_interval_start) + active_interval_target_start
-            elif markertype == 2:
-                assert node._id in remap_start_offsets, "Start was not encountered, possibly input data invalid or bug!"
-
-                stopOffset = (marker - active_interval_start) + active_interval_target_start + 1
-                startOffset = remap_start_offsets[node._id]
-
-                node[target_pos_remap] = target_text[startOffset:stopOffset]
+            n[target_pos_remap] = translate(n[source_pos_remap])
 
 
 def is_covered_by(span_a: TextSpan, span_b: TextSpan)->bool:
@@ -313,102 +743,105 @@ def group_by_span(group_nodes: List[Node],
 
     :return List of tuples: (group node, dictionary with layer name -> [ content of group for this layer ])
     """
-    if layer_span_field is None:
-        layer_span_field = defaultdict(lambda: "text")
+    # Span property name per layer, resolved once up front
+    span_names = {}  # type: Dict[str, str]
+    for layer_name in layer_nodes.keys():
+        if layer_span_field is None:
+            span_names[layer_name] = "text"
+        else:
+            try:
+                span_names[layer_name] = layer_span_field[layer_name]
+            except KeyError as e:
+                raise KeyError("Could not find span property name for layer: %s" % layer_name) from e
 
-    node_list = []  # type: List[Tuple[Tuple[int, int], Tuple[Optional[str], Node]]]
+    # Events are sorted by packed keys: position << 3 | (marker type + 2), with the (layer, node, start, stop)
+    # payload in a parallel list. Marker types: 0 = group start, -2 = group stop, 1 = node start, -1 = node stop,
+    # 3 and 4 = singleton start and stop.
+    keys = []  # type: List[int]
+    payloads = []  # type: List[Tuple[Optional[str], Node, int, int]]
 
     # 1. Convert all nodes to Start, Stop symbols with added context information
     for group_node in group_nodes:
         if group_span_field in group_node:
             span = group_node[group_span_field]  # type: TextSpan
+            start, stop = span.start, span.stop
+            payload = (None, group_node, start, stop)
 
-            if span.start == span.stop:
+            if start == stop:
                 # singleton
-                node_list.append(((span.start, 3), (None, group_node)))
-                node_list.append(((span.stop,  4), (None, group_node)))
+                keys.append(start << 3 | 5)
+                keys.append(stop << 3 | 6)
             else:
-                node_list.append(((span.start, 0), (None, group_node)))
-                node_list.append(((span.stop, -2), (None, group_node)))
+                keys.append(start << 3 | 2)
+                keys.append(stop << 3)
 
-    for layer_name, layer in layer_nodes.items():
-        try:
-            span_name = layer_span_field[layer_name]
-        except KeyError as e:
-            raise KeyError("Could not find span property name for layer: %s" % layer_name) from e
+            payloads.append(payload)
+            payloads.append(payload)
 
+    for layer_name, layer in layer_nodes.items():
+        span_name = span_names[layer_name]
         for layer_node in layer:
             if span_name in layer_node:
                 span = layer_node[span_name]  # type: TextSpan
+                start, stop = span.start, span.stop
+                payload = (layer_name, layer_node, start, stop)
 
-                if span.start == span.stop:
+                if start == stop:
                     # singleton
-                    node_list.append(((span.start, 3), (layer_name, layer_node)))
-                    node_list.append(((span.stop,  4), (layer_name, layer_node)))
+                    keys.append(start << 3 | 5)
+                    keys.append(stop << 3 | 6)
                 else:
-                    node_list.append(((span.start, 1), (layer_name, layer_node)))
-                    node_list.append(((span.stop, -1), (layer_name, layer_node)))
+                    keys.append(start << 3 | 3)
+                    keys.append(stop << 3 | 1)
 
-    # 2. Sort by start, stop
-    node_list.sort(key=lambda tup: tup[0])
+                payloads.append(payload)
+                payloads.append(payload)
 
-    node_list_groups = []  # type: List[List[Tuple[Tuple[int,int], Tuple[Optional[str], Node]]]]
-    current_group = None
-    for tup in node_list:
-        if tup[0] is not None and current_group == tup[0]:
-            node_list_groups[-1].append(tup)
-        else:
-            node_list_groups.append([tup])
+    # 2. Sort by start, stop
+    order = sorted(range(len(keys)), key=keys.__getitem__)
 
-    # 3. Run sweep, and assign all groups relevant nodes
-    groups = dict()  # type: Dict[Node, Dict[str, List[Node]]]
+    # 3. Run sweep, and assign all groups relevant nodes, the cover resolution is applied as nodes are assigned
+    cover = resolution == "cover"
+    layer_names = list(layer_nodes.keys())
     group_list = list()  # type: List[Tuple[Node, Dict[str, List[Node]]]]
-    open_nodes = set()
-    open_groups = set()
-
-    k = 0
-    while k < len(node_list_groups):
-        nodes = node_list_groups[k]
-        if 0 <= nodes[0][0][1] < 4:
-            # Group start
-            for _, (layer, node) in nodes:
-                if layer is not None:
-                    open_nodes.add((layer, node))
-                    for open_group in open_groups:
-                        groups[open_group][layer].append(node)
+    open_nodes = dict()  # type: Dict[int, Tuple[str, Node, int, int]], id(payload) -> payload in opening order
+    open_groups = dict()  # type: Dict[int, Tuple[Dict[str, List[Node]], int, int]], id(group node) -> group dict
+
+    for event in order:
+        payload = payloads[event]
+        layer, node, start, stop = payload
+        if 2 <= keys[event] & 7 < 6:
+            # Start
+            if layer is not None:
+                open_nodes[id(payload)] = payload
+                if cover:
+                    for group_dict, group_start, group_stop in open_groups.values():
+                        if start >= group_start and stop <= group_stop:
+                            group_dict[layer].append(node)
                 else:
-                    group_dict = {k: [] for k in layer_nodes.keys()}
-                    groups[node] = group_dict
-                    group_list.append((node, group_dict))
-                    open_groups.add(node)
+                    for group_dict, _, _ in open_groups.values():
+                        group_dict[layer].append(node)
+            else:
+                group_dict = {k: [] for k in layer_names} if include_empty_groups else defaultdict(list)
+                group_list.append((node, group_dict))
+                open_groups[id(node)] = (group_dict, start, stop)
 
-                    for open_layer, open_node in open_nodes:
+                for open_layer, open_node, node_start, node_stop in open_nodes.values():
+                    if not cover or (node_start >= start and node_stop <= stop):
                         group_dict[open_layer].append(open_node)
         else:
-            # Group stop
-            for _, (layer, node) in nodes:
-                if layer is not None:
-                    open_nodes.remove((layer, node))
-                else:
-                    open_groups.remove(node)
-
-        k += 1
-
-    # 4. Apply resolution algorithm if necessary
-    if resolution == "cover":
-        for i in range(len(group_list)):
-            group_node, layer_group_nodes = group_list[i]
-            group_span = group_node[group_span_field]
-            group_list[i] = (group_node, {
-                k: [n for n in v if is_covered_by(n[layer_span_field[k]], group_span)]
-                for k, v in layer_group_nodes.items()
-            })
+            # Stop
+            if layer is not None:
+                del open_nodes[id(payload)]
+            else:
+                del open_groups[id(node)]
 
-    # 5. Final filtering if necessary
+    # 4. Final filtering if necessary, group dicts only hold the layers assigned to, complete them in layer order
     if not include_empty_groups:
-        group_list = [grp for grp in group_list if sum(map(len, grp[1].values())) > 0]
+        group_list = [(group_node, {k: group_dict[k] for k in layer_names})
+                      for group_node, group_dict in group_list if group_dict]
 
-    # 4. Return result
+    # 5. Return result
     return group_list
 
 
@@ -420,33 +853,30 @@ def dominant_right(segments: List[Tuple[int, int, Any]])->List[Any]:
     :param segments: tuple of (start, stop, data)
     :return: list of data
     """
-    segment_list = []
-    for tup in segments:
-        start, stop, item = tup
-        segment_list.append(((start, 0), tup))
-        if start != stop:
-            segment_list.append(((stop-1, 1), tup))
-        else:
-            segment_list.append(((stop, 1), tup))
-
-    segment_list.sort(key=lambda el: el[0])
-
+    # A single scan in start order: a segment competes with the current best if it starts before the best's
+    # last position, the stop event of the best is implied by the first segment starting after it.
     segment_output = []
-    open_node = None
+    best = None
+    best_last = 0
+    best_length = 0
+
+    for segment in sorted(segments, key=itemgetter(0)):
+        start, stop, item = segment
+        if best is not None and start <= best_last:
+            if best_length <= stop-start:
+                best = segment
+                best_last = stop-1 if start != stop else stop
+                best_length = stop-start
+        else:
+            if best is not None:
+                segment_output.append(best[2])
 
-    for ((off, mode), tup) in segment_list:
-        if mode == 0:
-            if open_node is not None:
-                start, stop, item = open_node
+            best = segment
+            best_last = stop-1 if start != stop else stop
+            best_length = stop-start
 
-                if stop-start <= tup[1]-tup[0]:
-                    open_node = tup
-            else:
-                open_node = tup
-        else:
-            if open_node is tup:
-                segment_output.append(tup[2])
-                open_node = None
+    if best is not None:
+        segment_output.append(best[2])
 
     return segment_output
 
@@ -464,6 +894,92 @@ def dominant_right_span(nodes: Iterable[Node], spanfield: str="text")->List[Node
     return dominant_right(segments)
 
 
+class SpanIndex:
+    """
+    Index of nodes sorted by span, for repeated cover and overlap queries against the same nodes.
+
+    Queries are O(log N + K) where K is the number of candidates starting within the query range.
+    """
+    def __init__(self, nodes: Iterable[Node], spanfield: str="text"):
+        """
+        :param nodes: the nodes to index, nodes without a span are ignored
+        :param spanfield: the name of the spanfield
+        """
+        spans = sorted(((n[spanfield].start, n[spanfield].stop, n) for n in nodes if spanfield in n),
+                       key=itemgetter(0, 1))
+
+        self.starts = [span[0] for span in spans]
+        self.stops = [span[1] for span in spans]
+        self.nodes = [span[2] for span in spans]
+
+        # Running max of stops in start order, nodes before the first one reaching past a position all stop before it.
+        self.max_stops = list(accumulate(self.stops, max))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def covered_by(self, start: int, stop: int)->List[Node]:
+        """Get nodes covered by [start, stop) in span order, i.e. node_start >= start and node_stop <= stop."""
+        stops, nodes = self.stops, self.nodes
+
+        # Candidates start within the range, the ones which also stop within it are covered.
+        lo = bisect_left(self.starts, start)
+        hi = bisect_right(self.starts, stop)
+        return [nodes[i] for i in range(lo, hi) if stops[i] <= stop]
+
+    def overlapping(self, start: int, stop: int)->List[Node]:
+        """Get nodes sharing at least one character with [start, stop) in span order."""
+        stops, nodes = self.stops, self.nodes
+
+        lo = bisect_right(self.max_stops, start)
+        hi = bisect_left(self.starts, stop)
+        return [nodes[i] for i in range(lo, hi) if stops[i] > start]
+
+
+def parent_span_cover(parents: Iterable[Node],
+                      children: Union[Iterable[Node], SpanIndex],
+                      parent_span_field: str="text",
+                      children_span_field: str="text")->List[Tuple[Node, List[Node]]]:
+    """
+    Find the children covered by each parent, i.e. child_start >= parent_start and child_stop <= parent_stop.
+
+    :param parents: the parent nodes, nodes without a span are ignored
+    :param children: the child nodes or a SpanIndex of them, nodes without a span are ignored
+    :param parent_span_field: name of the textspan property of parents
+    :param children_span_field: name of the textspan property of children, not used if children is a SpanIndex
+
+    :return list of tuples: (parent, [ covered children in span order ])
+    """
+    if not isinstance(children, SpanIndex):
+        children = SpanIndex(children, children_span_field)
+
+    covered_by = children.covered_by
+    return [(parent, covered_by(parent[parent_span_field].start, parent[parent_span_field].stop))
+            for parent in parents if parent_span_field in parent]
+
+
+def parent_span_overlap(parents: Iterable[Node],
+                        children: Union[Iterable[Node], SpanIndex],
+                        parent_span_field: str="text",
+                        children_span_field: str="text")->List[Tuple[Node, List[Node]]]:
+    """
+    Find the children overlapping each parent, i.e. sharing at least one character with the parent span.
+
+    :param parents: the parent nodes, nodes without a span are ignored
+    :param children: the child nodes or a SpanIndex of them, nodes without a span are ignored
+    :param parent_span_field: name of the textspan property of parents
+    :param children_span_field: name of the textspan property of children, not used if children is a SpanIndex
+
+    :return list of tuples: (parent, [ overlapping children in span order ])
+    """
+    if not isinstance(children, SpanIndex):
+        children = SpanIndex(children, children_span_field)
+
+    overlapping = children.overlapping
+    return [(parent, overlapping(parent[parent_span_field].start, parent[parent_span_field].stop))
+            for parent in parents if parent_span_field in parent]
+
+
 def sequence_to_textspans(token_sequence: List[str],
                           text: Text,
                           start_offset: int = 0,
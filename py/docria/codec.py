@@ -20,10 +20,53 @@ import msgpack
 import json
 import logging
 from io import BytesIO, IOBase
-from typing import List, Dict, Tuple, TYPE_CHECKING
+from typing import List, Dict, Tuple, Iterator, TYPE_CHECKING
 from base64 import standard_b64decode, standard_b64encode
 import re
+import math
+import struct
+import sys
 import xml.etree.ElementTree
+from array import array
+from itertools import accumulate
+
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+
+def _json_dumps(obj, allow_orjson=True) -> str:
+    if orjson is not None and allow_orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. integers larger than 64 bits, let the standard library deal with it
+
+    return json.dumps(obj)
+
+
+def _json_finite(value) -> bool:
+    """Check that a JSON value has no NaN or infinite floats, orjson would write them as null."""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    elif isinstance(value, dict):
+        return all(map(_json_finite, value.values()))
+    elif isinstance(value, (list, tuple)):
+        return all(map(_json_finite, value))
+    else:
+        return True
+
+
+def _json_loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(data)
 
 
 class DataError(Exception):
@@ -32,83 +75,208 @@ class DataError(Exception):
         super().__init__(message)
 
 
-def _codec_encode_span(offset_mapping: Dict[int, int]):
-    def encoder(l, v: "TextSpan"):
-        if v is None:
-            l.append(None)
-            l.append(None)
+def _codec_encode_span(context: str):
+    def encoder(values: List["TextSpan"], offset_mapping):
+        offset_mapping = offset_mapping[context][0]  # type: Dict[int, int]
+
+        # Start and stop offset ids are built as two columns, stored interleaved: [start0, stop0, start1, ...]
+        propvalues = [None] * (2 * len(values))
+        propvalues[0::2] = [None if v is None else offset_mapping[v.start] for v in values]
+        propvalues[1::2] = [None if v is None else offset_mapping[v.stop] for v in values]
+        return propvalues
+    return encoder
+
+
+def _codec_encode_ext(values, offset_mapping):
+    propvalues = []
+    append = propvalues.append
+    for extv in values:
+        if extv is None or isinstance(extv, bytes):
+            append(extv)
+        elif isinstance(extv, ExtData):
+            append(extv.encode())
         else:
-            l.append(offset_mapping[v.start])
-            l.append(offset_mapping[v.stop])
+            raise ValueError("Incorrect value.")
+
+    return propvalues
+
+
+def _codec_encode_primitive(pytype: type):
+    """Column encoder for primitive values, converted to pytype"""
+    passthrough_types = {pytype, type(None)}
+
+    def encoder(values, offset_mapping):
+        if set(map(type, values)) <= passthrough_types:
+            # Already the correct type, the column can be used as is.
+            return values
+        else:
+            return [None if x is None else pytype(x) for x in values]
+
     return encoder
 
 
+def _codec_column_encoder(fieldtype: "DataType"):
+    """Get a column encoder for the field type: fn(values, offset_mapping) -> encoded column"""
+    typename = fieldtype.typename
+    if typename == DataTypeEnum.I32 or typename == DataTypeEnum.I64:
+        return _codec_encode_primitive(int)
+    elif typename == DataTypeEnum.F64:
+        return _codec_encode_primitive(float)
+    elif typename == DataTypeEnum.BOOL:
+        return _codec_encode_primitive(bool)
+    elif typename == DataTypeEnum.STRING:
+        return _codec_encode_primitive(str)
+    elif typename == DataTypeEnum.BINARY:
+        return _codec_encode_primitive(bytes)
+    elif typename == DataTypeEnum.NODEREF:
+        return lambda values, offset_mapping: [None if x is None else x.i for x in values]
+    elif typename == DataTypeEnum.NODEREF_MANY:
+        return lambda values, offset_mapping: [None if x is None or len(x) == 0 else [n.i for n in x]
+                                               for x in values]
+    elif typename == DataTypeEnum.NODEREF_SPAN:
+        return lambda values, offset_mapping: [None if x is None else [x.left.i, x.right.i - x.left.i]
+                                               for x in values]
+    elif typename == DataTypeEnum.SPAN:
+        return _codec_encode_span(fieldtype.options["context"])
+    elif typename == DataTypeEnum.EXT:
+        return _codec_encode_ext
+    else:
+        raise NotImplementedError("Unsupported field type: %s" % repr(typename))
+
+
+def _codec_encode_plan(schema: "NodeLayerSchema"):
+    """
+    Get the encode plan for a layer schema, cached on the schema until its fields change.
+
+    :return: tuple of encoded typeschema and list of (field, column encoder)
+    """
+    plan = schema._encode_plan
+    if plan is None:
+        typeschema = {}
+        encoders = []
+        for field, fieldtype in schema.fields.items():
+            typeschema[field] = fieldtype.encode()
+            encoders.append((field, _codec_column_encoder(fieldtype)))
+
+        plan = typeschema, encoders
+        schema._encode_plan = plan
+
+    return plan
+
+
+# Specialized column encodings, the tag is written in place of the per-column "special encoding" flag.
+# Packed columns are little-endian arrays stored as a single binary value. Not supported by the Java implementation.
+_PACKED_COLUMN_TAGS = {
+    DataTypeEnum.I32: "i32",
+    DataTypeEnum.I64: "i64",
+    DataTypeEnum.F64: "f64",
+    DataTypeEnum.BOOL: "bool",
+    DataTypeEnum.NODEREF: "i32"
+}
+
+_PACKED_COLUMN_TYPECODES = {
+    "i32": "i",
+    "i64": "q",
+    "f64": "d",
+    "bool": "b"
+}
+
+
+def _codec_pack_column(typename: DataTypeEnum, column: list):
+    """
+    Pack a numeric column as a binary value
+
+    :return: tuple of (tag, packed bytes) or None if the column cannot be packed i.e. it has missing values.
+    """
+    tag = _PACKED_COLUMN_TAGS.get(typename)
+    if tag is None or None in column:
+        return None
+
+    try:
+        packed = array(_PACKED_COLUMN_TYPECODES[tag], column)
+    except OverflowError:
+        return None
+
+    if sys.byteorder == "big":
+        packed.byteswap()
+
+    return tag, packed.tobytes()
+
+
+def _codec_dictionary_column(column: list):
+    """
+    Dictionary encode a string column with repeated values
+
+    :return: tuple of (tag, [dictionary, codes]) or None if there are too few repeated values.
+    """
+    uniq = {}
+    codes = [uniq.setdefault(v, len(uniq)) for v in column]
+    if 2 * len(uniq) > len(column):
+        return None
+
+    return "dict", [list(uniq), codes]
+
+
+def _codec_unpack_column(tag: str, data) -> list:
+    """Unpack a column created by _codec_pack_column or _codec_dictionary_column"""
+    if tag == "dict":
+        dictionary, codes = data
+        return list(map(dictionary.__getitem__, codes))
+
+    typecode = _PACKED_COLUMN_TYPECODES.get(tag)
+    if typecode is None:
+        raise DataError("Unsupported special encoding: %s" % repr(tag))
+
+    packed = array(typecode)
+    packed.frombytes(data)
+    if sys.byteorder == "big":
+        packed.byteswap()
+
+    if tag == "bool":
+        return list(map(bool, packed))
+    else:
+        return packed.tolist()
+
+
 class Codec:
     """Utility methods for all codecs"""
-    encoders = {
-        DataTypeEnum.I32: lambda l, v: l.append(None if v is None else int(v)),
-        DataTypeEnum.I64: lambda l, v: l.append(None if v is None else int(v)),
-        DataTypeEnum.F64: lambda l, v: l.append(None if v is None else float(v)),
-        DataTypeEnum.BOOL: lambda l, v: l.append(None if v is None else bool(v)),
-        DataTypeEnum.STRING: lambda l, v: l.append(None if v is None else str(v)),
-        DataTypeEnum.BINARY: lambda l, v: l.append(None if v is None else bytes(v)),
-        DataTypeEnum.NODEREF: lambda l, v: l.append(None if v is None else v.i),
-        DataTypeEnum.NODEREF_MANY: lambda l, v: l.append(None if v is None or len(v) == 0 else [n.i for n in v]),
-        DataTypeEnum.NODEREF_SPAN: lambda l, v: l.append(None if v is None else [v.left.i, v.right.i - v.left.i]),
-        DataTypeEnum.SPAN: _codec_encode_span
-    }
 
     @staticmethod
-    def encode(doc: "Document", doc_encoder, **kwargs):
+    def encode_texts(doc: "Document", **kwargs):
+        """
+        Compile the document and encode its texts
+
+        :return: tuple of offset mapping, as returned by Document.compile, and encoded texts
+        """
         offset_mapping = doc.compile(**kwargs)
 
         texts = {}
-        types = {}
-        types_num_nodes = {}
-        schema = {}
-
         for txt in doc.texts.values():
             texts[txt.name] = txt.compile(offset_mapping[txt.name][1])
 
-        node_getter = Node.get
+        return offset_mapping, texts
 
-        # Encode types
-        for k, v in doc.layers.items():
-            propfields = {}
-            typeschema = {}
-            for field, fieldtype in v.schema.fields.items():
-                typeschema[field] = fieldtype.encode()
+    @staticmethod
+    def encode_columns(layer: "NodeLayerCollection", offset_mapping) -> Iterator[Tuple[str, list]]:
+        """Encode the columns of a compiled layer one at a time, in schema order"""
+        typeschema, encoders = _codec_encode_plan(layer.schema)
+        for field, encoder in encoders:
+            # Materialize the column in one pass, then convert it with the type specialized encoder
+            yield field, encoder(layer[field].to_list(), offset_mapping)
 
-                propvalues = []
-                encoder = Codec.encoders[fieldtype.typename]
-                if fieldtype.typename == DataTypeEnum.EXT:
-                    for n in v:
-                        extv = node_getter(n, field, None)
-                        if extv is not None:
-                            if isinstance(extv, bytes):
-                                propvalues.append(extv)
-                            elif isinstance(extv, ExtData):
-                                propvalues.append(extv.encode())
-                            else:
-                                raise ValueError("Incorrect value.")
-                        else:
-                            propvalues.append(None)
-
-                        propvalues.append(None if extv is None else extv.encode())
-                elif fieldtype.typename == DataTypeEnum.SPAN:
-                    encoder = encoder(offset_mapping[fieldtype.options["context"]][0])
-                    for n in v:
-                        encoder(propvalues, node_getter(n, field, None))
-                else:
-                    for n in v:
-                        encoder(propvalues, node_getter(n, field, None))
+    @staticmethod
+    def encode(doc: "Document", doc_encoder, **kwargs):
+        offset_mapping, texts = Codec.encode_texts(doc, **kwargs)
 
-                propfields[field] = propvalues
+        types = {}
+        types_num_nodes = {}
+        schema = {}
 
+        # Encode types
+        for k, v in doc.layers.items():
             types_num_nodes[k] = v.num
-
-            schema[k] = typeschema
-            types[k] = propfields
+            schema[k] = _codec_encode_plan(v.schema)[0]
+            types[k] = dict(Codec.encode_columns(v, offset_mapping))
 
         return texts, types, types_num_nodes, schema
 
@@ -116,7 +284,8 @@ class Codec:
     def commit_layers(doc: "Document",
                       types: List[str],
                       schema: Dict[str, List[Tuple[str, any]]],
-                      all_nodes: Dict[str, List[Node]]):
+                      all_nodes: Dict[str, List[Node]],
+                      ref_patches: List[Tuple[List[Node], str, DataType, list]]=None):
         """
         Do post-processing after deserialization phase, for instance replace node ids with node references.
 
@@ -124,6 +293,8 @@ class Codec:
         :param types: layer names
         :param schema: schema definition
         :param all_nodes: dictionary of all nodes
+        :param ref_patches: node reference columns collected by the decoder as (nodes, field, type, column data),
+                            if given only these are resolved instead of scanning all layers for int placeholders.
         """
         # TODO: Replace types with schema being an OrderedDict
 
@@ -141,43 +312,76 @@ class Codec:
 
             layer.unsafe_initialize(all_nodes[typename])
 
-        # Post-process layers
+        if ref_patches is not None:
+            Codec.resolve_ref_patches(all_nodes, ref_patches)
+            return
+
+        # Post-process layers, all node reference columns of a layer are replaced in a single pass over its nodes.
         for typename in types:
-            for col, typedef in schema[typename]:
-                if typedef.typename == DataTypeEnum.NODEREF:
-
-                    # Replace int placeholds with an actual node reference.
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            n[col] = target_nodes[n[col]]
-                elif typedef.typename == DataTypeEnum.NODEREF_MANY:
-                    # Replace int placeholds with an actual node reference.
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            n[col] = [target_nodes[n_item] for n_item in n[col]]
-                elif typedef.typename == DataTypeEnum.NODEREF_SPAN:
-                    # Replace [int, int] with NodeSpan(left, right) which are real node references
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            lst = n[col]
-                            left_i, right_i = lst[0], lst[0]+lst[1]  # Delta encoded length
-                            n[col] = NodeSpan(target_nodes[left_i], target_nodes[right_i])
+            ref_cols = [(col, typedef.typename, all_nodes[typedef.options["layer"]])
+                        for col, typedef in schema[typename] if typedef.typename in _NODEREF_TYPES]
+
+            if len(ref_cols) == 0:
+                continue
+
+            for n in all_nodes[typename]:
+                for col, reftype, target_nodes in ref_cols:
+                    ref = n.get(col)
+                    if ref is None:
+                        continue
+
+                    # Replace int placeholders with actual node references.
+                    if reftype == DataTypeEnum.NODEREF:
+                        n[col] = target_nodes[ref]
+                    elif reftype == DataTypeEnum.NODEREF_MANY:
+                        n[col] = list(map(target_nodes.__getitem__, ref))
+                    else:
+                        # Replace [int, int] with NodeSpan(left, right), delta encoded length
+                        n[col] = NodeSpan(target_nodes[ref[0]], target_nodes[ref[0]+ref[1]])
+
+    @staticmethod
+    def resolve_ref_patches(all_nodes: Dict[str, List[Node]],
+                            ref_patches: List[Tuple[List[Node], str, DataType, list]]):
+        """
+        Set node reference fields directly from their decoded column data.
+
+        :param all_nodes: dictionary of all nodes
+        :param ref_patches: list of (nodes, field, type, column data)
+        """
+        for nodes, col, typedef, data in ref_patches:
+            target_nodes = all_nodes[typedef.options["layer"]]
+
+            if typedef.typename == DataTypeEnum.NODEREF:
+                for n, ref in zip(nodes, data):
+                    if ref is not None:
+                        n[col] = target_nodes[ref]
+            elif typedef.typename == DataTypeEnum.NODEREF_MANY:
+                target_node = target_nodes.__getitem__
+                for n, refs in zip(nodes, data):
+                    if refs is not None:
+                        n[col] = list(map(target_node, refs))
+            elif typedef.typename == DataTypeEnum.NODEREF_SPAN:
+                for n, lst in zip(nodes, data):
+                    if lst is not None:
+                        left_i = lst[0]
+                        n[col] = NodeSpan(target_nodes[left_i], target_nodes[left_i+lst[1]])  # Delta encoded length
 
 
 class JsonCodec:
     """JSON codec"""
     @staticmethod
     def encode(doc: "Document"):
-        return json.dumps(JsonCodec.encode_object(doc))
+        docobj = JsonCodec.encode_object(doc)
+
+        # Floats can only be found in properties and F64 columns, NaN and infinity must be written by json.
+        types = docobj["DM10"]["types"]
+        finite = _json_finite(doc.props) and all(
+            _json_finite(types[typename][field])
+            for typename, layer in doc.layers.items()
+            for field, fieldtype in layer.schema.fields.items() if fieldtype.typename == DataTypeEnum.F64
+        )
+
+        return _json_dumps(docobj, allow_orjson=finite)
 
     @staticmethod
     def encode_object(doc: "Document"):
@@ -194,7 +398,7 @@ class JsonCodec:
 
     @staticmethod
     def decode(docstr):
-        docobj = json.loads(docstr)
+        docobj = _json_loads(docstr)
         if not isinstance(docobj, dict):
             raise DataError("JSON object is not a dictionary => cannot be a document.")
 
@@ -213,8 +417,6 @@ class JsonCodec:
         schema = {}  # type: Dict[str, List[Tuple[str, DataType]]]
 
         for typename, fieldtypes in docobj["schema"].items():
-            nl = NodeLayerSchema(typename)
-
             fields = []
 
             for fieldname, typedef in fieldtypes.items():
@@ -229,121 +431,60 @@ class JsonCodec:
                     raise DataError("Could not decode layer %s field types, " \
                                     "failed on field %s. Got data: %s" % (typename, fieldname, repr(typedef)))
 
-                nl.add(fieldname, fields[-1][1])
-
             schema[typename] = fields
 
-        texts = docobj["texts"]
-        text2offsets = {}
-        for textname, text in texts.items():
-            offsets = []
-            pos = 0
-            for subseq in text:
-                offsets.append(pos)
-                pos += len(subseq)
-
-            offsets.append(pos)
-
-            fulltext = "".join(text)
-
-            doc.add_text(textname, fulltext)
-            text2offsets[textname] = dict(zip(range(len(offsets)), offsets))
+        text2offsets = MsgpackCodec.compute_text_offsets(doc, docobj["texts"])
 
         all_nodes = {}
+        ref_patches = []
         types_num_nodes = docobj["num_nodes"]
 
-        for typename in schema.keys():
+        for typename, fields in schema.items():
             num_nodes = types_num_nodes[typename]
-            nodes = [Node().with_id(i) for i in range(num_nodes)]
-            all_nodes[typename] = nodes
-
-            for col, typedef in schema[typename]:
-                def simple_field(data):
-                    nonlocal nodes
-
-                    for n, v in zip(nodes, data):
-                        if v is not None:
-                            n[col] = v
-
-                def span_field(text, offsets):
-                    nonlocal nodes
-
-                    def decoder(data):
-                        for n, v in zip(nodes, range(int(len(data)/2))):
-                            if data[v*2] is not None:
-                                n[col] = TextSpan(text, offsets[data[v * 2]], offsets[data[v * 2 + 1]])
-
-                    return decoder
-
-                def ext_field(data):
-                    nonlocal nodes
-
-                    typename = typedef.options["type"]
-                    if typename == "doc":
+            layerdata = docobj["types"][typename]
+
+            # Decode every column into final per node values, None for missing values
+            colnames = []
+            colvalues = []
+            ref_columns = []
+            for col, typedef in fields:
+                coldata = layerdata[col]
+                if typedef.typename in _NODEREF_TYPES:
+                    # Resolved by Codec.commit_layers once all layers have been decoded.
+                    ref_columns.append((col, typedef, coldata))
+                    continue
+                elif typedef.typename == DataTypeEnum.SPAN:
+                    context = typedef.options["context"]
+                    text = doc.texts[context]
+                    offsets = text2offsets.get(context, None)
+                    # Walk start, stop pairs with a single iterator instead of slicing the column twice.
+                    it = iter(coldata)
+                    coldata = [None if start is None else TextSpan(text, offsets[start], offsets[stop])
+                               for start, stop in zip(it, it)]
+                elif typedef.typename == DataTypeEnum.EXT:
+                    exttype = typedef.options["type"]
+                    if exttype == "doc":
                         extdata = MsgpackDocumentExt
                     else:
-                        extdata = lambda v: ExtData(typename, v)
+                        extdata = lambda v: ExtData(exttype, v)
 
-                    for n, v in zip(nodes, data):
-                        if v is not None:
-                            n[col] = typename(standard_b64decode(data))
+                    coldata = [None if v is None else extdata(standard_b64decode(v)) for v in coldata]
 
-                decoder = simple_field
-                if typedef.typename == DataTypeEnum.SPAN:
-                    decoder = span_field(doc.texts[typedef.options["context"]], text2offsets[typedef.options["context"]])
-
-                if typedef.typename == DataTypeEnum.EXT:
-                    decoder = ext_field
-
-                coldata = docobj["types"][typename][col]
-                decoder(coldata)
+                colnames.append(col)
+                colvalues.append(coldata)
 
-        # TODO: Replace with Codec.commit_layers
-        # Insert layers
-        for typename in schema.keys():
-
-            # Create Node Type
-            nt = NodeLayerSchema(typename)
-            for col, typedef in schema[typename]:
-                nt.add(col, typedef)
-
-            layer = doc.add_layer(nt)
-            for n in all_nodes[typename]:
-                n.collection = layer
-
-            layer.unsafe_initialize(all_nodes[typename])
+            # Materialize all nodes in one pass
+            if len(colvalues) > 0:
+                all_nodes[typename] = [
+                    Node({k: v for k, v in zip(colnames, row) if v is not None}).with_id(i)
+                    for i, row in enumerate(zip(*colvalues))
+                ]
+            else:
+                all_nodes[typename] = [Node().with_id(i) for i in range(num_nodes)]
 
-        # Post-process layers
-        for typename in schema.keys():
-            for col, typedef in schema[typename]:
-                if typedef.typename == DataTypeEnum.NODEREF:
-
-                    # Replace int placeholds with an actual node reference.
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            n[col] = target_nodes[n[col]]
-                elif typedef.typename == DataTypeEnum.NODEREF_MANY:
-                    # Replace int placeholds with an actual node reference.
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            n[col] = [target_nodes[n_item] for n_item in n[col]]
-                elif typedef.typename == DataTypeEnum.NODEREF_SPAN:
-                    # Replace [int, int] with NodeSpan(left, right) which are real node references
-                    target_type = typedef.options["layer"]
-                    target_nodes = all_nodes[target_type]
-
-                    for n in all_nodes[typename]:
-                        if col in n:
-                            lst = n[col]
-                            left_i, right_i = lst[0], lst[0]+lst[1]  # Delta encoded length
-                            n[col] = NodeSpan(target_nodes[left_i], target_nodes[right_i])
+            ref_patches.extend((all_nodes[typename], col, typedef, coldata) for col, typedef, coldata in ref_columns)
 
+        Codec.commit_layers(doc, list(schema.keys()), schema, all_nodes, ref_patches)
         return doc
 
 
@@ -412,7 +553,7 @@ class MsgpackDocument:
         if self._read_state < 1 and state > 0:
             self.rawdata.seek(4)
 
-            unpacker = msgpack.Unpacker(self.rawdata, raw=False)
+            unpacker = msgpack.Unpacker(self.rawdata, raw=False, read_size=_HEADER_READ_SIZE)
             prop_sz = next(unpacker)
             prop_start = unpacker.tell() + 4
 
@@ -433,19 +574,20 @@ class MsgpackDocument:
         if self._read_state < 3 and state > 2:
             start_pos = self._texts[0] + self._texts[1]
             self.rawdata.seek(start_pos)
-            unpacker = msgpack.Unpacker(self.rawdata, raw=False)
 
             layer_mapping = {}
             for typename in self._schema[0]:
+                unpacker = msgpack.Unpacker(self.rawdata, raw=False, read_size=_HEADER_READ_SIZE)
                 layer_len = next(unpacker)
                 layer_start = unpacker.tell() + start_pos
                 layer_mapping[typename] = (layer_start, layer_len)
                 self.rawdata.seek(layer_start+layer_len)
-                unpacker = msgpack.Unpacker(self.rawdata, raw=False)
                 start_pos = layer_start + layer_len
 
             self._layers = layer_mapping
 
+        self._read_state = max(self._read_state, state)
+
     def binary(self)->bytes:
         """Get this document as binary value"""
         return self.rawdata.getvalue()
@@ -488,6 +630,7 @@ class MsgpackDocument:
         # -- Parse layers
         layer_set = types if len(layers) == 0 else list(layers)
         all_nodes = {}
+        ref_patches = []
         for typename in layer_set:
             self.rawdata.seek(self._layers[typename][0])
             unpacker = msgpack.Unpacker(self.rawdata, raw=False)
@@ -495,9 +638,10 @@ class MsgpackDocument:
             #unpacker.skip()
 
             layerschema = schema[typename]
-            all_nodes[typename] = MsgpackCodec.decode_layer(unpacker, doc, typename, text2offsets, layerschema, **kwargs)
+            all_nodes[typename] = MsgpackCodec.decode_layer(unpacker, doc, typename, text2offsets, layerschema,
+                                                            ref_patches=ref_patches, **kwargs)
 
-        Codec.commit_layers(doc, types, schema, all_nodes)
+        Codec.commit_layers(doc, types, schema, all_nodes, ref_patches)
         return doc
 
 
@@ -520,6 +664,52 @@ class MsgpackDocumentExt(ExtData):
             return self.data
 
 
+# Field types holding references to nodes, resolved once all layers have been decoded
+_NODEREF_TYPES = {DataTypeEnum.NODEREF, DataTypeEnum.NODEREF_MANY, DataTypeEnum.NODEREF_SPAN}
+
+# Shared instances of field types without arguments, keyed by type name
+_simple_datatypes = {}  # type: Dict[str, DataType]
+
+# Section length prefix: msgpack uint32 (0xce) followed by a big-endian 32-bit length, always 5 bytes.
+_SECTION_HEADER = struct.Struct(">BI")
+
+# Read size for unpackers that only decode a section length, a msgpack integer is at most 9 bytes.
+# The default read size buffers up to 1 MiB of the stream, which is wasted when seeking past each section.
+_HEADER_READ_SIZE = 16
+
+
+def _msgpack_layer_schema(schema: "NodeLayerSchema"):
+    """
+    Get the MessagePack encoded schema of a layer, cached on the schema as long as its encode plan is.
+
+    :return: the encoded schema bytes
+    """
+    plan = _codec_encode_plan(schema)
+    cached = schema._msgpack_schema
+    if cached is None or cached[0] is not plan:
+        typeschema = plan[0]
+        packer = msgpack.Packer(use_bin_type=True, autoreset=False)
+        pack = packer.pack
+        pack(len(typeschema))
+
+        for k, v in typeschema.items():
+            pack(k)
+            if isinstance(v, str):
+                pack(False)
+                pack(v)
+            elif isinstance(v, dict):
+                pack(True)
+                pack(v["type"])
+                pack(v["args"])
+            else:
+                raise NotImplementedError()
+
+        cached = plan, packer.bytes()
+        schema._msgpack_schema = cached
+
+    return cached[1]
+
+
 class MsgpackCodec:
     """MessagePack document codec"""
     @staticmethod
@@ -591,79 +781,87 @@ class MsgpackCodec:
                 print(" ==> %s" % next(unpacker))
 
     @staticmethod
-    def encode(doc, **kwargs):
+    def encode(doc, packed_columns=False, dictionary_strings=False, **kwargs):
         """
         Encode document using MessagePack encoder
 
         :param doc: the document to encode
+        :param packed_columns: store numeric columns without missing values as packed binary arrays,
+                               faster to encode/decode but can not be read by the Java implementation.
+        :param dictionary_strings: store string columns where most values are repeated as a dictionary of
+                                   unique values and codes, can not be read by the Java implementation.
         :param kwargs: passed along to Codec.encode and Document.compile
         :raises SchemaValidationError
         :return: bytes of the document
         """
-        texts, types, types_num_nodes, schema = Codec.encode(doc, doc_encoder=MsgpackCodec.encode, **kwargs)
-        output = BytesIO()
-        typelist = list(types.keys())
+        # Columns are encoded and packed one at a time instead of materializing every layer up front.
+        offset_mapping, texts = Codec.encode_texts(doc, **kwargs)
+        output = bytearray(b"DM_1")
+        typelist = list(doc.layers.keys())
 
-        output.write(b"DM_1")
+        # Values are packed into the packer's own buffer, which is moved into output once per section.
+        packer = msgpack.Packer(use_bin_type=True, autoreset=False)
+        pack = packer.pack
 
-        # 1. Write Document properties
-        out_props = BytesIO()
+        def flush(length_prefixed=False):
+            with packer.getbuffer() as buf:
+                if length_prefixed:
+                    output.extend(_SECTION_HEADER.pack(0xce, len(buf)))
 
-        # TODO: Implement extension handling!
-        msgpack.pack(doc.props, out_props)
+                output.extend(buf)
+
+            packer.reset()
 
-        msgpack.pack(out_props.tell(), output)
-        output.write(out_props.getbuffer()[0:out_props.tell()])
+        # 1. Write Document properties
+        # TODO: Implement extension handling!
+        pack(doc.props)
+        flush(length_prefixed=True)
 
         # 2. Write Inventory of types
-        msgpack.pack(typelist, output, use_bin_type=True)
-        types2columns = {}
+        pack(typelist)
+        flush()
 
         # 3. Write Schema
         for typename in typelist:
-            type_def = schema[typename]
-            msgpack.pack(len(type_def), output, use_bin_type=True)
-
-            layer_cols = []
-            for k, v in type_def.items():
-                layer_cols.append(k)
-
-                msgpack.pack(k, output, use_bin_type=True)
-                if isinstance(v, str):
-                    msgpack.pack(False, output)
-                    msgpack.pack(v, output, use_bin_type=True)
-                elif isinstance(v, dict):
-                    msgpack.pack(True, output)
-                    msgpack.pack(v["type"], output, use_bin_type=True)
-                    msgpack.pack(v["args"], output, use_bin_type=True)
-                else:
-                    raise NotImplementedError()
-
-            types2columns[typename] = layer_cols
-
-        out_texts = BytesIO()
+            output.extend(_msgpack_layer_schema(doc.layers[typename].schema))
 
         # 4. Write Texts
-        msgpack.pack(texts, out_texts, use_bin_type=True)
-
-        msgpack.pack(out_texts.tell(), output)
-        output.write(out_texts.getbuffer()[0:out_texts.tell()])
+        pack(texts)
+        flush(length_prefixed=True)
 
         # 5. Write Type data
-        out_types = BytesIO()
+        # The offset mapping is only used by span columns, it is released after the last layer with one.
+        span_layers = [typename for typename in typelist
+                       if any(fieldtype.typename == DataTypeEnum.SPAN
+                              for fieldtype in doc.layers[typename].schema.fields.values())]
+        last_span_layer = span_layers[-1] if len(span_layers) > 0 else None
+
         for typename in typelist:
-            out_type = BytesIO()
-            msgpack.pack(types_num_nodes[typename], out_type)
-            for col in types2columns[typename]:
-                msgpack.pack(False, out_type)  # Future support for specialized encoding
-                msgpack.pack(types[typename][col], out_type, use_bin_type=True)
+            layer = doc.layers[typename]
+            pack(layer.num)
+            layer_fields = layer.schema.fields
+            for col, column in Codec.encode_columns(layer, offset_mapping):
+                coltype = layer_fields[col].typename
+                packed = None
+                if packed_columns:
+                    packed = _codec_pack_column(coltype, column)
+                if packed is None and dictionary_strings and coltype == DataTypeEnum.STRING:
+                    packed = _codec_dictionary_column(column)
+
+                if packed is None:
+                    pack(False)
+                    pack(column)
+                else:
+                    pack(packed[0])
+                    pack(packed[1])
                 # TODO: Implement extension handling!
 
-            msgpack.pack(out_type.tell(), out_types)
-            out_types.write(out_type.getbuffer()[0:out_type.tell()])
+            if typename == last_span_layer:
+                offset_mapping = None
 
-        output.write(out_types.getbuffer()[0:out_types.tell()])
-        return output.getvalue()
+            flush(length_prefixed=True)
+
+        return bytes(output)
 
     @staticmethod
     def decode_property(unpacker: msgpack.Unpacker, *props, **kwargs):
@@ -687,29 +885,28 @@ class MsgpackCodec:
 
     @staticmethod
     def decode_schema(unpacker: msgpack.Unpacker):
-        types = next(unpacker)
+        unpack = unpacker.unpack
+        types = unpack()
         schema = {}  # type: Dict[str, List[Tuple[str, DataType]]]
 
         for typename in types:
-            num_fields = next(unpacker)
-
-            nl = NodeLayerSchema(typename)
-
+            num_fields = unpack()
             fields = []
 
             for i in range(num_fields):
-                fieldname = next(unpacker)
-                has_args = next(unpacker)
-                fieldtype = next(unpacker)
-                ttype = String2DataType[fieldtype]
+                fieldname = unpack()
+                has_args = unpack()
+                fieldtype = unpack()
 
                 if has_args:
-                    fieldargs = next(unpacker)
-                    fields.append((fieldname, DataType(ttype, **fieldargs)))
+                    fieldargs = unpack()
+                    fields.append((fieldname, DataType(String2DataType[fieldtype], **fieldargs)))
                 else:
-                    fields.append((fieldname, DataType(ttype)))
+                    datatype = _simple_datatypes.get(fieldtype)
+                    if datatype is None:
+                        datatype = _simple_datatypes.setdefault(fieldtype, DataType(String2DataType[fieldtype]))
 
-                nl.add(fieldname, fields[-1][1])
+                    fields.append((fieldname, datatype))
 
             schema[typename] = fields
 
@@ -720,19 +917,19 @@ class MsgpackCodec:
         if len(texts) == 0:
             return next(unpacker)
         else:
-            texts = {}
+            text_keys = set(texts)
+            output = {}
 
-            prop_keys = set(texts)
             num_entries = unpacker.read_map_header()
             for i in range(num_entries):
                 k = next(unpacker)
-                if k in prop_keys:
-                    v = next(unpacker)
-                    texts[k] = v
+                if k in text_keys:
+                    output[k] = next(unpacker)
                 else:
+                    # Skipping avoids decoding the segments of unrequested texts.
                     unpacker.skip()
 
-            return texts
+            return output
 
     @staticmethod
     def compute_text_offsets(doc, texts):
@@ -740,23 +937,17 @@ class MsgpackCodec:
 
         text2offsets = {}
         for textname, text in texts.items():
-            offsets = []
-            pos = 0
-            for subseq in text:
-                offsets.append(pos)
-                pos += len(subseq)
-
-            offsets.append(pos)
-
-            fulltext = "".join(text)
+            # Offset i is the start of segment i, the last offset is the length of the text.
+            offsets = array("q", [0])
+            offsets.extend(accumulate(map(len, text)))
 
-            doc.add_text(textname, fulltext)
-            text2offsets[textname] = dict(zip(range(len(offsets)), offsets))
+            doc.add_text(textname, "".join(text))
+            text2offsets[textname] = offsets
 
         return text2offsets
 
     @staticmethod
-    def decode_layer(unpacker, doc, typename, text2offsets, layerschema, *fields, **kwargs):
+    def decode_layer(unpacker, doc, typename, text2offsets, layerschema, *fields, ref_patches=None, **kwargs):
         num_nodes = next(unpacker)
         nodes = [Node().with_id(i) for i in range(num_nodes)]
 
@@ -764,53 +955,54 @@ class MsgpackCodec:
         if len(fields) > 0:
             fieldindx = set(fields)
 
+        def simple_field(col, typedef, data):
+            if None in data:
+                for n, v in zip(nodes, data):
+                    if v is not None:
+                        n[col] = v
+            else:
+                for n, v in zip(nodes, data):
+                    n[col] = v
+
+        def doc_field(col, typedef, data):
+            # Embedded documents are decoded on demand, untouched ones are written back as is when re-encoded.
+            for n, v in zip(nodes, data):
+                if v is not None:
+                    n[col] = MsgpackDocumentExt(v)
+
+        def ext_field(col, typedef, data):
+            types = typedef.options["type"]
+            for n, v in zip(nodes, data):
+                if v is not None:
+                    n[col] = ExtData(types, v)
+
+        def span_field(col, typedef, data):
+            context = typedef.options["context"]
+            text = doc.texts.get(context, None)
+            if text is None:
+                if len(data) > 0:
+                    logging.warning("Node field is referring to non existant context: %s, "
+                                    "cannot decode this field: %s in %s. "
+                                    "Field ignored." % (context, col, typename))
+                return
+
+            offsets = text2offsets.get(context, None)
+            it = iter(data)
+            for n, start, stop in zip(nodes, it, it):
+                if start is not None:
+                    n[col] = TextSpan(text, offsets[start], offsets[stop])
+
+        def ref_field(col, typedef, data):
+            # Resolved by Codec.commit_layers once all layers have been decoded.
+            ref_patches.append((nodes, col, typedef, data))
+
         for col, typedef in layerschema:
             if fieldindx is None or col in fieldindx:
-                def simple_field(data):
-                    nonlocal nodes
-
-                    for n, v in zip(nodes, data):
-                        if v is not None:
-                            n[col] = v
-
-                def doc_field(data):
-                    nonlocal nodes
-
-                    for n, v in zip(nodes, data):
-                        if v is not None:
-                            n[col] = MsgpackCodec.decode(v)
-
-                def ext_field(data):
-                    types = typedef.options["type"]
-                    if types == "doc":
-                        extdata = MsgpackDocumentExt
-                    else:
-                        extdata = lambda v: ExtData(types, v)
-
-                    for n, v in zip(nodes, data):
-                        if v is not None:
-                            n[col] = extdata(v.data)
-
-                def span_field(text, offsets):
-                    nonlocal nodes
-
-                    def decoder(data):
-                        if text is None and len(data) > 0:
-                            logging.warning("Node field is referring to non existant context: %s, "
-                                            "cannot decode this field: %s in %s. "
-                                            "Field ignored." % (typedef.options["context"], col, typename))
-                        else:
-                            for n, v in zip(nodes, range(int(len(data)/2))):
-                                if data[v*2] is not None:
-                                    n[col] = TextSpan(text, offsets[data[v * 2]], offsets[data[v * 2 + 1]])
-
-                    return decoder
-
                 decoder = simple_field
-                if typedef.typename == DataTypeEnum.SPAN:
-                    decoder = span_field(
-                        doc.texts.get(typedef.options["context"], None),
-                        text2offsets.get(typedef.options["context"], None))
+                if ref_patches is not None and typedef.typename in _NODEREF_TYPES:
+                    decoder = ref_field
+                elif typedef.typename == DataTypeEnum.SPAN:
+                    decoder = span_field
                 elif typedef.typename == DataTypeEnum.EXT:
                     if typedef.options["type"] == "doc":
                         decoder = doc_field
@@ -818,16 +1010,14 @@ class MsgpackCodec:
                         decoder = ext_field
 
                 special_encoding = next(unpacker)
-                if special_encoding:
-                    raise NotImplementedError("special_encoding")
-
                 coldata = next(unpacker)
-                decoder(coldata)
-            else:
-                special_encoding = next(unpacker)
                 if special_encoding:
-                    raise NotImplementedError("special_encoding")
+                    coldata = _codec_unpack_column(special_encoding, coldata)
 
+                decoder(col, typedef, coldata)
+            else:
+                # special encoding flag
+                unpacker.skip()
                 unpacker.skip()
 
         return nodes
@@ -873,15 +1063,17 @@ class MsgpackCodec:
 
         # -- Parse layers
         all_nodes = {}
+        ref_patches = []
         for typename in types:
             # datalength = next(unpacker)
             unpacker.skip()
 
             layerschema = schema[typename]
             all_nodes[typename] = MsgpackCodec.decode_layer(unpacker, doc, typename,
-                                                            text2offsets, layerschema, **kwargs)
+                                                            text2offsets, layerschema,
+                                                            ref_patches=ref_patches, **kwargs)
 
-        Codec.commit_layers(doc, types, schema, all_nodes)
+        Codec.commit_layers(doc, types, schema, all_nodes, ref_patches)
         return doc
 
 
@@ -25,10 +25,14 @@ import lzma
 from typing import Iterator
 import struct
 import importlib
+import importlib.util
+import warnings
 from docria.model import Document
 from docria.codec import MsgpackDocument
 import tarfile
 import time
+import queue
+import threading
 
 
 def _module_available(name):
@@ -96,16 +100,23 @@ class _BoundaryReader(RawIOBase):
         if (abs_stop_position >> self.boundary) << self.boundary == abs_stop_position:
             real_length -= 4
 
+        if real_length == len(alldata):
+            # No boundary markers inside the read, the raw data is the output.
+            self.offset += real_length
+            return bytes(alldata)
+
         output = bytearray(real_length)
+        data = memoryview(alldata)
+        boundary = self.boundary
 
         output_position = 0
         rel_position = 0
         current_position = abs_start_position
 
         while current_position < abs_stop_position:
-            max_read = min(((current_position >> self.boundary) + 1) << self.boundary, abs_stop_position)-current_position
+            max_read = min(((current_position >> boundary) + 1) << boundary, abs_stop_position)-current_position
 
-            output[output_position:output_position+max_read] = alldata[rel_position:rel_position+max_read]
+            output[output_position:output_position+max_read] = data[rel_position:rel_position+max_read]
             rel_position += 4 + max_read
             current_position += max_read + 4
             output_position += max_read
@@ -125,6 +136,9 @@ class _BoundaryReader(RawIOBase):
         return False
 
 
+_BOUNDARY_DELTA = struct.Struct(">i")
+
+
 class _BoundaryWriter(RawIOBase):
     def __init__(self, outputio, boundary=20, **kwargs):
         super().__init__()
@@ -161,7 +175,7 @@ class _BoundaryWriter(RawIOBase):
         if delta <= -0x80000000:
             deltapos = -0x80000000
 
-        self.outputio.write(struct.pack(">i", deltapos))
+        self.outputio.write(_BOUNDARY_DELTA.pack(deltapos))
 
         self.written += 4
         self.seg += 1
@@ -170,21 +184,97 @@ class _BoundaryWriter(RawIOBase):
         pos = 0
         left = len(data)
 
-        maxwrite = min(((self.seg + 1) << self.boundary) - self.written, left)
+        maxwrite = ((self.seg + 1) << self.boundary) - self.written
+        if left <= maxwrite:
+            # Fits in the current segment, no boundary to insert.
+            if left > 0:
+                self.outputio.write(data)
+                self.written += left
+            return
+
+        # Every segment after the first one starts with a 4 byte boundary marker.
+        data = memoryview(data)
+        write = self.outputio.write
+        segment_payload = (1 << self.boundary) - 4
         while left > 0:
-            self.outputio.write(data[pos:pos+maxwrite])
+            write(data[pos:pos+maxwrite])
             pos += maxwrite
             self.written += maxwrite
             left -= maxwrite
 
             if left > 0:
                 self._write_boundary()
-                maxwrite = min(((self.seg + 1) << self.boundary) - self.written, left)
+                maxwrite = min(segment_payload, left)
 
     def close(self):
         self.outputio.close()
 
 
+class _DecompressingReader(RawIOBase):
+    """Decompresses a block incrementally as it is read, seeking backwards restarts decompression."""
+    def __init__(self, data: bytes, decompressobj: Callable[[], "zlib._Decompress"], chunk_size=1 << 16):
+        super().__init__()
+        self._data = memoryview(data)
+        self._decompressobj = decompressobj
+        self._chunk_size = chunk_size
+        self._restart()
+
+    def _restart(self):
+        self._decompressor = self._decompressobj()
+        self._pending = b""
+        self._consumed = 0
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if whence != SEEK_SET:
+            raise NotImplementedError()
+
+        if offset < self._position:
+            self._restart()
+
+        while self._position < offset:
+            if len(self.read(min(offset - self._position, self._chunk_size))) == 0:
+                break
+
+        return self._position
+
+    def read(self, n=-1):
+        decompressor = self._decompressor
+        if n == 0:
+            return b""
+        elif n is None or n < 0:
+            output = decompressor.decompress(self._pending) + \
+                decompressor.decompress(self._data[self._consumed:]) + \
+                decompressor.flush()
+
+            self._pending = b""
+            self._consumed = len(self._data)
+        else:
+            # Feed compressed input in chunks, the unconsumed tail is copied on every call.
+            output = b""
+            while len(output) == 0:
+                if len(self._pending) == 0:
+                    self._pending = self._data[self._consumed:self._consumed + self._chunk_size]
+                    self._consumed += len(self._pending)
+                    if len(self._pending) == 0:
+                        break
+
+                output = decompressor.decompress(self._pending, n)
+                self._pending = decompressor.unconsumed_tail
+
+        self._position += len(output)
+        return output
+
+
 class MsgpackDocumentBlock:
     """
     Represents a block of MessagePack docria documents
@@ -192,9 +282,9 @@ class MsgpackDocumentBlock:
     .. automethod:: __iter__
     .. automethod:: __next__
     """
-    def __init__(self, position: int, rawbuffer: bytes):
+    def __init__(self, position: int, rawbuffer: Union[bytes, RawIOBase]):
         self._dataread = 0
-        self._data = BytesIO(rawbuffer)
+        self._data = BytesIO(rawbuffer) if isinstance(rawbuffer, (bytes, bytearray)) else rawbuffer
         self._unpacker = Unpacker(self._data, raw=False)
         self._position = position
 
@@ -242,20 +332,28 @@ class MsgpackDocumentBlock:
 
 
 class CompressionCodec:
-    def __init__(self, name, compress: Callable[[bytes],bytes], decompress: Callable[[bytes],bytes]):
+    def __init__(self, name, compress: Callable[[bytes],bytes], decompress: Callable[[bytes],bytes],
+                 decompressobj: Optional[Callable[[], "zlib._Decompress"]]=None):
+        """
+        :param decompressobj: optional factory for zlib-style incremental decompressors,
+                              used to decompress blocks while they are being read.
+        """
         self.name = name
         self.compress = compress
         self.decompress = decompress
+        self.decompressobj = decompressobj
 
 
 _Name2Codec = {}
 
 
-def register_codec(name, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes], codec_name=None):
+def register_codec(name, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes], codec_name=None,
+                   decompressobj=None):
     if name in _Name2Codec:
         raise ValueError(f"Codec {name} already registered")
 
-    _Name2Codec[name] = CompressionCodec(codec_name if codec_name is not None else name, compress, decompress)
+    _Name2Codec[name] = CompressionCodec(codec_name if codec_name is not None else name, compress, decompress,
+                                         decompressobj)
 
 
 def unregister_codec(name):
@@ -271,11 +369,17 @@ def get_codec(name, no_except=False)->Union[CompressionCodec, None]:
 
 
 register_codec("none", lambda x: x, lambda x: x)
-register_codec("zip", zlib.compress, zlib.decompress)
+register_codec("zip", zlib.compress, zlib.decompress, decompressobj=zlib.decompressobj)
 register_codec("bzip2", bz2.compress, bz2.decompress)
-register_codec("zipsq", lambda x: zlib.compress(
-                    zlib.compress(x, level=zlib.Z_BEST_COMPRESSION), level=zlib.Z_BEST_COMPRESSION),
-               lambda x: zlib.decompress(zlib.decompress(x)))
+
+
+def _zipsq_compress(x):
+    warnings.warn("The zipsq codec is deprecated, the second deflate pass costs CPU without improving the "
+                  "ratio, use zip, lzma or zstd for new collections.", DeprecationWarning, stacklevel=2)
+    return zlib.compress(zlib.compress(x, level=zlib.Z_BEST_COMPRESSION), level=zlib.Z_BEST_COMPRESSION)
+
+
+register_codec("zipsq", _zipsq_compress, lambda x: zlib.decompress(zlib.decompress(x)))
 register_codec("lzma", lzma.compress, lzma.decompress)
 
 if not TYPE_CHECKING and _module_available("lz4.frame"):
@@ -298,11 +402,51 @@ if not TYPE_CHECKING and _module_available("zstd"):
         register_codec("zstd:ultra", lambda x: zstd.compress(x, 22), zstd.decompress, codec_name="zstd")
     except ModuleNotFoundError:
         pass
+elif not TYPE_CHECKING and _module_available("zstandard"):
+    try:
+        import zstandard
+
+        def _zstandard_codec(level):
+            # Compression contexts are reused, but they are not thread-safe, so each thread gets its own.
+            contexts = threading.local()
+
+            def compress(x):
+                compressor = getattr(contexts, "compressor", None)
+                if compressor is None:
+                    compressor = contexts.compressor = zstandard.ZstdCompressor(level=level)
+
+                return compressor.compress(x)
+
+            def decompress(x):
+                decompressor = getattr(contexts, "decompressor", None)
+                if decompressor is None:
+                    decompressor = contexts.decompressor = zstandard.ZstdDecompressor()
+
+                return decompressor.decompressobj().decompress(x)
+
+            return compress, decompress
+
+        register_codec("zstd", *_zstandard_codec(3))
+        register_codec("zstd:high", *_zstandard_codec(9), codec_name="zstd")
+        register_codec("zstd:ultra", *_zstandard_codec(22), codec_name="zstd")
+    except ModuleNotFoundError:
+        pass
+
+
+# Seconds between checks of the stop flag while the prefetch worker waits for room in its queue
+_PREFETCH_POLL_INTERVAL = 0.1
 
 
 class MsgpackDocumentReader:
     """Reader for the blocked MessagePack document file format"""
-    def __init__(self, inputio: RawIOBase):
+    def __init__(self, inputio: RawIOBase, prefetch=False):
+        """
+        Primary constructor
+
+        :param inputio: the underlying I/O device to read from.
+        :param prefetch: read and decompress the next block in a background thread while iterating,
+                         the thread is started on the first call to next.
+        """
         self.inputio = inputio
         self.dataread = 4
         header = self.inputio.read(4)
@@ -312,7 +456,9 @@ class MsgpackDocumentReader:
         self.unpacker = Unpacker(self.inputio, raw=False)
 
         codecname = next(self.unpacker)
-        self.codec = get_codec(codecname).decompress
+        codec = get_codec(codecname)
+        self.codec = codec.decompress
+        self.decompressobj = codec.decompressobj
 
         self.num_doc_per_block = next(self.unpacker)
         self.advanced = next(self.unpacker)
@@ -322,6 +468,11 @@ class MsgpackDocumentReader:
         self.block = None  # type: MsgpackDocumentBlock
         self._lastblockpos = inputio.tell()
 
+        self.prefetch = prefetch
+        self._prefetched = None  # type: Optional[queue.Queue]
+        self._prefetch_stop = None  # type: Optional[threading.Event]
+        self._prefetch_thread = None  # type: Optional[threading.Thread]
+
     def __iter__(self)->Iterator[MsgpackDocument]:
         return self
 
@@ -329,7 +480,12 @@ class MsgpackDocumentReader:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.inputio.close()
+        self.close()
+
+    def __del__(self):
+        # Stops an abandoned prefetch worker, __init__ might have failed before it was set.
+        if getattr(self, "_prefetched", None) is not None:
+            self._stop_prefetch()
 
     def get(self, ref):
         """
@@ -342,7 +498,8 @@ class MsgpackDocumentReader:
         :note:
         This method assumes and requires that the underlying I/O supports seeking.
         """
-        if self.block is None or self.block.position != ref[0]:
+        # Blocks left by iteration may be decompressed incrementally, they are read again to seek cheaply.
+        if self.block is None or self.block.position != ref[0] or isinstance(self.block._data, _DecompressingReader):
             self.seek(ref[0])
             self.block = self.readblock()
 
@@ -358,6 +515,7 @@ class MsgpackDocumentReader:
         :note:
         This method assumes and requires that the underlying I/O supports seeking.
         """
+        self._stop_prefetch()
         self.block = None
         self.inputio.seek(position, SEEK_SET)
         self.unpacker = Unpacker(self.inputio, raw=False)
@@ -374,15 +532,87 @@ class MsgpackDocumentReader:
 
     def readblock(self)->Optional[MsgpackDocumentBlock]:
         """Read a single block if possible"""
+        if self._prefetched is not None:
+            # The prefetch worker owns the underlying stream while it is active.
+            return self._next_block()
+
+        return self._readblock(incremental=False)
+
+    def _readblock(self, incremental: bool)->Optional[MsgpackDocumentBlock]:
         self._lastblockpos = self.unpacker.tell() + self.dataread
         data = next(self.unpacker, None)
         if data is None:
             return None
+        elif incremental and self.decompressobj is not None:
+            # Decompress while the block is parsed, the full uncompressed block is never materialized.
+            # Only for sequential iteration, seeking backwards restarts decompression.
+            return MsgpackDocumentBlock(self._lastblockpos, _DecompressingReader(data, self.decompressobj))
         else:
             buf = self.codec(data)
             blk = MsgpackDocumentBlock(self._lastblockpos, buf)
             return blk
 
+    @staticmethod
+    def _prefetch_worker(unpacker: Unpacker, dataread: int, codec: Callable[[bytes], bytes],
+                         blocks: "queue.Queue", stop: threading.Event):
+        # Holds no reference to the reader, so that an abandoned reader can be collected and stop the worker.
+        def put(item)->bool:
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=_PREFETCH_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+
+            return False
+
+        try:
+            while not stop.is_set():
+                position = unpacker.tell() + dataread
+                data = next(unpacker, None)
+                if data is None:
+                    break
+
+                # Decompress fully here, zlib and friends release the GIL while doing so.
+                if not put(MsgpackDocumentBlock(position, codec(data))):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(None)
+
+    def _stop_prefetch(self):
+        if self._prefetched is not None:
+            self._prefetch_stop.set()
+            self._prefetch_thread.join()
+
+            self._prefetched = None
+            self._prefetch_stop = None
+            self._prefetch_thread = None
+
+    def _next_block(self)->Optional[MsgpackDocumentBlock]:
+        if not self.prefetch:
+            return self._readblock(incremental=True)
+
+        if self._prefetched is None:
+            self._prefetched = queue.Queue(maxsize=2)
+            self._prefetch_stop = threading.Event()
+            self._prefetch_thread = threading.Thread(
+                target=MsgpackDocumentReader._prefetch_worker,
+                args=(self.unpacker, self.dataread, self.codec, self._prefetched, self._prefetch_stop),
+                daemon=True
+            )
+            self._prefetch_thread.start()
+
+        block = self._prefetched.get()
+        if block is None:
+            # Keep signalling end of stream for subsequent calls.
+            self._prefetched.put(None)
+        elif isinstance(block, Exception):
+            raise block
+
+        return block
+
     def __next__(self)->MsgpackDocument:
         if self.block is not None:
             start = self.block.tell()
@@ -390,10 +620,10 @@ class MsgpackDocumentReader:
             if doc is None:
                 self.block = None
             else:
-                return MsgpackDocument(doc, ref=(self._lastblockpos, start))
+                return MsgpackDocument(doc, ref=(self.block.position, start))
 
         while self.block is None:
-            datablock = self.readblock()
+            datablock = self._next_block()
             if datablock is None:
                 raise StopIteration()
 
@@ -403,9 +633,10 @@ class MsgpackDocumentReader:
             if doc is None:
                 self.block = None
             else:
-                return MsgpackDocument(doc, ref=(self._lastblockpos, start))
+                return MsgpackDocument(doc, ref=(self.block.position, start))
 
     def close(self):
+        self._stop_prefetch()
         self.inputio.close()
 
 
@@ -453,7 +684,8 @@ class MsgpackDocumentWriter:
         if isinstance(self.outputio, _BoundaryWriter):
             self.outputio.split()
 
-        self.currentblock = BytesIO()
+        # Documents are packed straight into a reused block buffer, reset after every flush.
+        self.blockpacker = Packer(use_bin_type=True, autoreset=False)
         self.current_block_count = 0
         self.codec_name = codec.name
         self.codec = codec.compress  # type: Callable[[bytes], bytes]
@@ -481,7 +713,7 @@ class MsgpackDocumentWriter:
         else:
             raise ValueError("Got unsupported doc, only Document and MsgpackDocument allowed")
 
-        self.currentblock.write(self.packer.pack(data))
+        self.blockpacker.pack(data)
         self.current_block_count += 1
 
         if self.current_block_count == self.num_docs_per_block:
@@ -496,12 +728,12 @@ class MsgpackDocumentWriter:
         This might result in blocks having less than specified number of documents per block.
         """
         if self.current_block_count > 0:
-            self.outputio.write(self.packer.pack(self.codec(self.currentblock.getvalue())))
+            self.outputio.write(self.packer.pack(self.codec(self.blockpacker.bytes())))
 
             if isinstance(self.outputio, _BoundaryWriter):
                 self.outputio.split()
 
-            self.currentblock = BytesIO()
+            self.blockpacker.reset()
             self.current_block_count = 0
 
     def close(self):
@@ -17,7 +17,9 @@
 """Docria document model ( **primary module** )"""
 
 from typing import Dict, List, Tuple, Callable, Any, Iterator, Iterable, Union, Set, Optional, Sized
-from enum import Enum
+from enum import IntEnum
+from itertools import repeat, chain
+from operator import attrgetter
 from .query import *
 
 
@@ -79,6 +81,7 @@ class Node(dict):
     >>> print(node.keys())  # return set fields
     >>> print("pos" in node)  # check if pos field is set.
     """
+    __slots__ = ("_id", "collection")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -284,14 +287,14 @@ class NodeFieldCollection(Sized):
         return len(self.collection)
 
     def __iter__(self):
-        return map(lambda n: n.get(self.field), self.collection)
+        return map(dict.get, self.collection, repeat(self.field))
 
     def __getitem__(self, item):
         return self.collection[item][self.field]
 
     def to_list(self):
         """Convert this node field collection to a python list with field elements."""
-        return [v for v in self]
+        return list(self)
 
     def filter(self, cond: Callable[[Any], bool]):
         """
@@ -580,14 +583,13 @@ class TextSpan:
     :note:
     Use str(span) to get a real string.
     """
+    __slots__ = ("text", "_start", "_stop")
 
     def __init__(self, text: "Text", start_offset: int, stop_offset: int):
         assert start_offset <= stop_offset, "start must be <= end"
         self.text = text
         self._start = start_offset
         self._stop = stop_offset
-        self.start_offset = start_offset
-        self.stop_offset = stop_offset
 
     @property
     def start(self) -> int:
@@ -597,6 +599,9 @@ class TextSpan:
     def stop(self) -> int:
         return self._stop
 
+    start_offset = start
+    stop_offset = stop
+
     def __len__(self):
         return self._stop - self._start
 
@@ -773,15 +778,12 @@ class Text:
         :type offsets: the offsets including 0 and length of text
         :return: List of segments
         """
+        text = self.text
+        if len(offsets) == 2:
+            # Single segment, no need to slice
+            return [text]
 
-        output = []
-        for i in range(len(offsets) - 1):
-            start = offsets[i]
-            stop = offsets[i + 1]
-
-            output.append(self.text[start:stop])
-
-        return output
+        return [text[start:stop] for start, stop in zip(offsets, offsets[1:])]
 
     def offset(self, indx) -> int:
         assert 0 <= indx <= len(self.text), "Offset %d not valid: " \
@@ -842,7 +844,7 @@ class ExtData:
         return self.data
 
 
-class DataTypeEnum(Enum):
+class DataTypeEnum(IntEnum):
     """Type names"""
     UNKNOWN = 0  # unsupported for serialization
     I32 = 1
@@ -897,7 +899,11 @@ class DataType:
     def __init__(self, typename: DataTypeEnum, **kwargs):
         self.typename = typename
         self.nativetype = DataType2PyType.get(typename, None)
-        self.options = dict(kwargs)
+        self.options = dict(kwargs)  # considered immutable after construction, see _key
+
+        # Identity used by __hash__ and __eq__, option keys are unique so only keys are compared when sorting.
+        self._key = (typename, tuple(sorted(self.options.items())))
+        self._hash = None
 
     def default(self):
         return self.options.get("default")
@@ -943,6 +949,10 @@ class DataType:
     def is_valid(self, value):
         return True
 
+    def all_valid(self, values: List[Any]) -> bool:
+        """Check a whole column of non-None field values, equivalent to is_valid on every value."""
+        return all(map(self.is_valid, values))
+
     def __repr__(self):
         return "DataType(type=%s, options=%s)" % (
             DataType2String.get(self.typename, str(self.typename)),
@@ -950,10 +960,13 @@ class DataType:
         )
 
     def __hash__(self):
-        return hash((self.typename, tuple(sorted(self.options.items(), key=lambda x: x[0]))))
+        if self._hash is None:
+            self._hash = hash(self._key)
+
+        return self._hash
 
     def __eq__(self, dt):
-        return self is dt or (self.typename == dt.typename and self.options == dt.options)
+        return self is dt or (isinstance(dt, DataType) and self._key == dt._key)
 
 
 class DataTypeBool(DataType):
@@ -965,6 +978,9 @@ class DataTypeBool(DataType):
     def is_valid(self, value) -> bool:
         return value is not None and isinstance(value, bool)
 
+    def all_valid(self, values):
+        return set(map(type, values)) <= {bool} or super().all_valid(values)
+
 
 class DataTypeInt32(DataType):
     """Signed 32 bit integer field type"""
@@ -975,6 +991,12 @@ class DataTypeInt32(DataType):
     def is_valid(self, value) -> bool:
         return isinstance(value, int) and (-0x80000000 <= value <= 0x7FFFFFFF)
 
+    def all_valid(self, values):
+        if len(values) > 0 and set(map(type, values)) <= {int}:
+            return -0x80000000 <= min(values) and max(values) <= 0x7FFFFFFF
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeInt64(DataType):
     """Signed 64 bit integer field type"""
@@ -985,6 +1007,12 @@ class DataTypeInt64(DataType):
     def is_valid(self, value) -> bool:
         return isinstance(value, int) and (-0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF)
 
+    def all_valid(self, values):
+        if len(values) > 0 and set(map(type, values)) <= {int}:
+            return -0x8000000000000000 <= min(values) and max(values) <= 0x7FFFFFFFFFFFFFFF
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeFloat(DataType):
     """64 bit floating point (double) field type"""
@@ -995,6 +1023,9 @@ class DataTypeFloat(DataType):
     def is_valid(self, value) -> bool:
         return isinstance(value, float)
 
+    def all_valid(self, values):
+        return set(map(type, values)) <= {float} or super().all_valid(values)
+
 
 class DataTypeString(DataType):
     """String field type"""
@@ -1005,6 +1036,12 @@ class DataTypeString(DataType):
     def is_valid(self, value) -> bool:
         return isinstance(value, str) and len(value) < (2 ** 31)
 
+    def all_valid(self, values):
+        if set(map(type, values)) <= {str}:
+            return max(map(len, values), default=0) < (2 ** 31)
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeBinary(DataType):
     """Bytes field type, field with raw binary data"""
@@ -1015,6 +1052,12 @@ class DataTypeBinary(DataType):
     def is_valid(self, value) -> bool:
         return isinstance(value, bytes) and len(value) < (2 ** 31)
 
+    def all_valid(self, values):
+        if set(map(type, values)) <= {bytes}:
+            return max(map(len, values), default=0) < (2 ** 31)
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeNodespan(DataType):
     """Nodespan field type, sequence of nodes"""
@@ -1041,6 +1084,14 @@ class DataTypeTextspan(DataType):
         return isinstance(value, TextSpan) and \
                value.text.name == self.options["context"]
 
+    def all_valid(self, values):
+        if set(map(type, values)) <= {TextSpan}:
+            # Spans share a handful of Text objects, check each distinct one once.
+            context = self.options["context"]
+            return all(text.name == context for text in set(map(attrgetter("text"), values)))
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeNoderef(DataType):
     """Node reference field type in same or other layer"""
@@ -1053,6 +1104,15 @@ class DataTypeNoderef(DataType):
                value.collection is not None and \
                value.collection.name == self.options["layer"]
 
+    def all_valid(self, values):
+        if set(map(type, values)) <= {Node}:
+            # Referenced nodes share a handful of layers, check each distinct one once.
+            target_layer = self.options["layer"]
+            return all(layer is not None and layer.name == target_layer
+                       for layer in set(map(attrgetter("collection"), values)))
+        else:
+            return super().all_valid(values)
+
 
 class DataTypeNoderefList(DataType):
     """Multi node reference field type in same or other layer"""
@@ -1065,6 +1125,14 @@ class DataTypeNoderefList(DataType):
         return (isinstance(value, list) or isinstance(value, NodeCollection)) and \
                all(map(lambda n: n.collection is not None and n.collection.name == target_layer, value))
 
+    def all_valid(self, values):
+        if all(issubclass(t, (list, NodeCollection)) for t in set(map(type, values))):
+            target_layer = self.options["layer"]
+            return all(layer is not None and layer.name == target_layer
+                       for layer in set(map(attrgetter("collection"), chain.from_iterable(values))))
+        else:
+            return super().all_valid(values)
+
 
 class DataTypes:
     """Layer field type factory"""
@@ -1175,43 +1243,55 @@ class DataTypes:
 
     @staticmethod
     def typeof(o, comparetype: "DataType" = None) -> DataType:
-        if isinstance(o, str):
-            return DataTypes.string()
-        elif isinstance(o, int):
-            if comparetype is not None and comparetype.typename == DataTypeEnum.I32:
-                if -0x80000000 <= o <= 0x7FFFFFFF:
-                    return DataTypes.int32()
-                else:
-                    return DataTypes.int64()
-            else:
-                return DataTypes.int64()
-        elif isinstance(o, float):
-            return DataTypes.float64()
-        elif isinstance(o, bool):
-            return DataTypes.bool()
-        elif isinstance(o, bytes):
-            return DataTypes.binary
-        elif isinstance(o, TextSpan):
-            return o.text.spantype
-        elif isinstance(o, NodeSpan):
-            return DataTypes.nodespan(o.left.collection.name)
-        elif isinstance(o, Node):
-            return o.collection.nodetype
-        elif isinstance(o, list):
-            if len(o) > 0 and not isinstance(o[0], Node):
-                raise ValueError("Unsupported type: %s" % type(o))
-            elif len(o) == 0 and comparetype is not None and comparetype.typename == DataTypeEnum.NODEREF_MANY:
-                return comparetype
-            elif len(o) == 0:  # Assume an empty node list
-                return DataType(DataTypeEnum.NODEREF_MANY)
-            else:
-                layer = o[0].collection
-                if sum(1 for n in o if isinstance(n, Node) and n.collection is layer) == len(o):
-                    return DataTypes.noderef_many(layer.name)
-                else:
-                    raise ValueError("Unsupported type: %s" % type(o))
+        handler = _typeof_handlers.get(type(o))
+        if handler is not None:
+            return handler(o, comparetype)
+
+        # Subclasses of the supported types, bool must be checked before int as it is a subclass of int.
+        for basetype in (bool, str, int, float, bytes, TextSpan, NodeSpan, Node, list):
+            if isinstance(o, basetype):
+                return _typeof_handlers[basetype](o, comparetype)
+
+        raise ValueError("Unsupported type: %s" % type(o))
+
+
+def _typeof_int(o, comparetype):
+    if comparetype is not None and comparetype.typename == DataTypeEnum.I32:
+        if -0x80000000 <= o <= 0x7FFFFFFF:
+            return DataTypes.int32()
         else:
-            raise ValueError("Unsupported type: %s" % type(o))
+            return DataTypes.int64()
+    else:
+        return DataTypes.int64()
+
+
+def _typeof_list(o, comparetype):
+    if len(o) > 0 and not isinstance(o[0], Node):
+        raise ValueError("Unsupported type: %s" % type(o))
+    elif len(o) == 0 and comparetype is not None and comparetype.typename == DataTypeEnum.NODEREF_MANY:
+        return comparetype
+    elif len(o) == 0:  # Assume an empty node list
+        return DataType(DataTypeEnum.NODEREF_MANY)
+    else:
+        layer = o[0].collection
+        for n in o:
+            if not isinstance(n, Node) or n.collection is not layer:
+                raise ValueError("Unsupported type: %s" % type(o))
+
+        return DataTypes.noderef_many(layer.name)
+
+
+_typeof_handlers = {
+    str: lambda o, comparetype: DataTypes.string(),
+    int: _typeof_int,
+    float: lambda o, comparetype: DataTypes.float64(),
+    bool: lambda o, comparetype: DataTypes.bool(),
+    bytes: lambda o, comparetype: DataTypes.binary,
+    TextSpan: lambda o, comparetype: o.text.spantype,
+    NodeSpan: lambda o, comparetype: DataTypes.nodespan(o.left.collection.name),
+    Node: lambda o, comparetype: o.collection.nodetype,
+    list: _typeof_list
+}  # type: Dict[type, Callable[[Any, Optional[DataType]], DataType]]
 
 
 class NodeLayerSchema:
@@ -1224,6 +1304,8 @@ class NodeLayerSchema:
     def __init__(self, name: str):
         self.name = name
         self.fields = {}  # type: Dict[str, DataType]
+        self._encode_plan = None
+        self._msgpack_schema = None
 
     def add(self, name: str, fieldtype: Union[Callable, "DataType"]):
         if name in self.fields:
@@ -1233,6 +1315,7 @@ class NodeLayerSchema:
         assert isinstance(fieldtype, DataType), "Type of field '%s' is not a DataType, it is: %s" % \
                                                 (name, repr(fieldtype))
         self.fields[name] = fieldtype
+        self._encode_plan = None
         return self
 
     def set(self, **kwargs):
@@ -1245,6 +1328,12 @@ class NodeLayerSchema:
 
             self.fields[k] = v
 
+        self._encode_plan = None
+        return self
+
+    def remove(self, name: str):
+        del self.fields[name]
+        self._encode_plan = None
         return self
 
 
@@ -1352,7 +1441,7 @@ class NodeLayerCollection(NodeCollection):
                 if name in n:
                     del n[name]
 
-        del self._schema.fields[name]
+        self._schema.remove(name)
         self._update_default_values()
         return True
 
@@ -1549,17 +1638,35 @@ class NodeLayerCollection(NodeCollection):
         for i, n in zip(range(len(self)), self):
             n._id = i
 
-    def remove(self, node: Union["Node", Iterable["Node"]]):
+    def _remove_unordered(self, node: "Node"):
+        """Remove node by moving the last node into its slot, O(1) but changes the order of nodes."""
+        nodes = self._nodes
+        last = nodes.pop()
+        while last is None:
+            # Drop trailing gaps left by ordered removals
+            last = nodes.pop()
+
+        if last is not node:
+            nodes[node._id] = last
+            last._id = node._id
+
+    def remove(self, node: Union["Node", Iterable["Node"]], stable=True):
         """
         Remove nodes
 
         :param node: the node or list of nodes to remove
+        :param stable: keep the order of the remaining nodes, if False the last node is moved
+                       into the slot of each removed node which avoids leaving gaps and compacting.
         """
         if isinstance(node, Node):
             if node.collection is not self:
                 raise ValueError("Node %s is not in this node collection %s" % (repr(node), self.name))
 
-            self._nodes[node._id] = None
+            if stable:
+                self._nodes[node._id] = None
+            else:
+                self._remove_unordered(node)
+
             self.num -= 1
             node.collection = None
         else:
@@ -1570,7 +1677,11 @@ class NodeLayerCollection(NodeCollection):
                         if n.collection is not self:
                             raise ValueError("Node %s is not in this node collection %s" % (repr(node), self.name))
 
-                        self._nodes[n._id] = None
+                        if stable:
+                            self._nodes[n._id] = None
+                        else:
+                            self._remove_unordered(n)
+
                         self.num -= 1
                         n.collection = None
                     elif n is None:
@@ -1897,27 +2008,30 @@ class Document:
         for k, v in sorted(self.layers.items(), key=lambda tup: tup[0]):
             print("[%s]" % k)
             max_length = max(map(len, v.schema.fields.keys()), default=0)
+            field_format = " * {:<%d} : {:}{:}" % max_length
 
             for field, fieldtype in v.schema.fields.items():
-                print((" * {:<%d} : {:}{:}" % max_length).format(
+                options = fieldtype.options
+                print(field_format.format(
                     field,
                     DataType2String[fieldtype.typename],
-                    "" if len(fieldtype.options) == 0
-                    else "[%s]" % ", ".join(map(lambda tup: "%s=%s" % tup, fieldtype.options.items()))
+                    "[%s]" % ", ".join(["%s=%s" % tup for tup in options.items()]) if options else ""
                 ))
             print()
 
     def __getstate__(self):
         from docria.codec import MsgpackCodec
 
-        return {
-            "msgpacked": MsgpackCodec.encode(self)
-        }
+        return MsgpackCodec.encode(self)
 
     def __setstate__(self, state):
         from docria.codec import MsgpackCodec
 
-        doc = MsgpackCodec.decode(state["msgpacked"])
+        if isinstance(state, dict):
+            # Pickles created before the state was the encoded document itself.
+            state = state["msgpacked"]
+
+        doc = MsgpackCodec.decode(state)
         self._layers = doc.layers
         self._texts = doc.texts
         self.props = doc.props
@@ -1983,10 +2097,20 @@ class Document:
 
             # Validate nodes
             if type_validation and not extra_fields_ok:
+                # Validate column by column, if any column fails the nodes are checked in order
+                # so that the first invalid node is the one reported by the detailed validate.
+                validators = []
+                if not all(fieldtype.all_valid([n[field] for n in v if field in n])
+                           for field, fieldtype in fieldtypes.items()):
+                    validators = [(field, fieldtype.is_valid) for field, fieldtype in fieldtypes.items()]
+
                 for n in v:
-                    validate_fn(n)
+                    for field, is_valid in validators:
+                        if field in n and not is_valid(n[field]):
+                            validate_fn(n)
+                            break
 
-                    if not extra_fields_ok and len(set(n.keys()).difference(fieldkeys)) > 0:
+                    if not fieldkeys.issuperset(n.keys()):
                         raise SchemaValidationError(
                             "Extra fields not declared in schema was found for layer %s, fields: %s" % (
                                 k, ", ".join(set(n.keys()).difference(fieldkeys))), set(n.keys())
@@ -2011,6 +2135,6 @@ class Document:
             offsets.add(len(v.text))
 
             sorted_offsets = sorted(offsets)
-            text_offset_mapping[k] = ({k: v for k, v in zip(sorted_offsets, range(len(offsets)))}, sorted_offsets)
+            text_offset_mapping[k] = (dict(zip(sorted_offsets, range(len(sorted_offsets)))), sorted_offsets)
 
         return text_offset_mapping
@@ -18,6 +18,7 @@
 
 from typing import List, Dict, Tuple, Optional
 from html import escape
+from itertools import repeat
 import re
 
 
@@ -110,16 +111,25 @@ class TableStyle:
 
 
 def truncate(text):
+    return _truncator()(text)
+
+
+def _truncator():
+    """Get a truncate function with the current options resolved, for use across many cells."""
     if options.max_column_width is None:
-        return text
-    else:
-        min_sz = min(options._max_display_width-5, options.max_column_width-5)
+        return lambda text: text
+
+    min_sz = min(options._max_display_width-5, options.max_column_width-5)
+    part = min_sz >> 1
+
+    def truncate_text(text):
         if len(text) > min_sz:
-            part = min_sz >> 1
             return "%s ... %s" % (text[0:part], text[-part:])
         else:
             return text
 
+    return truncate_text
+
 
 class TableRow:
     def __init__(self, *elems, index=None):
@@ -187,17 +197,19 @@ class Table:
         else:
             self.footer = TableRow(*row)
 
-    def format_text(self, row: TableRow, index: int):
+    def format_text(self, row: TableRow, index: int, truncate_fn=None):
+        truncate_fn = truncate_fn or _truncator()
         output = [str(row.index) if row.index is not None else str(index)]
         for col in row.elems:
             if isinstance(col, TableCell):
-                output.append(truncate(col.text))
+                output.append(truncate_fn(col.text))
             else:
-                output.append(truncate(str(col)))
+                output.append(truncate_fn(str(col)))
 
         return output
 
-    def format_html(self, row: TableRow, index: int):
+    def format_html(self, row: TableRow, index: int, truncate_fn=None):
+        truncate_fn = truncate_fn or _truncator()
         output = [str(row.index) if row.index is not None else str(index)]
         for col in row.elems:
             if isinstance(col, TableCell):
@@ -209,58 +221,59 @@ class Table:
                     urn_type = parts[1].lower()
                     if urn_type in URN_LINK_FN:
                         output.append("<a href='{0}'>{1}</a>".format(
-                            URN_LINK_FN[urn_type](parts[2]), escape(truncate(str(col)))
+                            URN_LINK_FN[urn_type](parts[2]), escape(truncate_fn(str(col)))
                             )
                         )
                         continue
 
-            output.append(escape(truncate(str(col))))
+            output.append(escape(truncate_fn(str(col))))
 
         return output
 
     def _compile_text(self):
-        headers = self.format_text(self.header, 0)
+        truncate_fn = _truncator()
+        headers = self.format_text(self.header, 0, truncate_fn)
+        widths = [0] * len(headers)
+
+        def format_rows(rows):
+            nonlocal widths
+            for index, row in rows:
+                output = self.format_text(row=row, index=index, truncate_fn=truncate_fn)
+                widths = list(map(max, widths, map(len, output)))
+                yield output
 
         if options.max_rows is not None and len(self.body) > options.max_rows:
-            body = []
             part = options.max_rows >> 1
-            upper_part = zip(range(0, part), self.body[0:part])
-            lower_part = zip(range(len(self.body)-part, len(self.body)), self.body[-part:])
-
-            body.extend(list(map(lambda tup: self.format_text(row=tup[1], index=tup[0]), upper_part)))
+            body = list(format_rows(enumerate(self.body[0:part])))
             body.append(None)
-            body.extend(list(map(lambda tup: self.format_text(row=tup[1], index=tup[0]), lower_part)))
+            body.extend(format_rows(enumerate(self.body[-part:], len(self.body)-part)))
         else:
-            body = list(map(lambda tup: self.format_text(row=tup[1], index=tup[0]), zip(range(len(self.body)), self.body)))
+            body = list(format_rows(enumerate(self.body)))
 
-        return headers, body
+        return headers, body, widths
 
     def _compile_html(self):
-        headers = self.format_html(self.header, 0)
+        truncate_fn = _truncator()
+        headers = self.format_html(self.header, 0, truncate_fn)
 
         if options.max_rows is not None and len(self.body) > options.max_rows:
-            body = []
             part = options.max_rows >> 1
-            upper_part = zip(range(0, part), self.body[0:part])
-            lower_part = zip(range(len(self.body)-part, len(self.body)), self.body[-part:])
-
-            body.extend(list(map(lambda tup: self.format_html(row=tup[1], index=tup[0]), upper_part)))
+            body = [self.format_html(row, index, truncate_fn) for index, row in enumerate(self.body[0:part])]
             body.append(None)
-            body.extend(list(map(lambda tup: self.format_html(row=tup[1], index=tup[0]), lower_part)))
+            body.extend(self.format_html(row, index, truncate_fn)
+                        for index, row in enumerate(self.body[-part:], len(self.body)-part))
         else:
-            body = list(map(lambda tup: self.format_html(tup[1], tup[0]), zip(range(len(self.body)), self.body)))
+            body = [self.format_html(row, index, truncate_fn) for index, row in enumerate(self.body)]
 
         return headers, body
 
-    def _get_column_format(self, width):
-        return "%s%s%s" % (" " * self.style.padding, "{:<%d}" % width, " " * self.style.padding)
-
     def render_text(self):
         output = []
-        headers, rows = self._compile_text()
-
+        headers, rows, row_widths = self._compile_text()
         col_widths = list(map(len, headers))
-        row_widths = [max(map(len, map(lambda row: row[i], filter(lambda x: x is not None, rows))), default=0) for i in range(len(headers))]
+
+        padding = " " * self.style.padding
+        column_format = padding + "{:<%d}" + padding
 
         if self.hide_header:
             actual_widths = row_widths
@@ -292,14 +305,14 @@ class Table:
             # Print header
             if self.hide_index:
                 real_header = headers[column_pos:column_end]
-                line_format = "".join([self._get_column_format(actual_widths[k]) for k in range(column_pos, column_end)])
+                line_format = "".join([column_format % width for width in actual_widths[column_pos:column_end]])
             else:
                 real_header = [headers[0]] + headers[column_pos:column_end]
-                line_format = "".join([self._get_column_format(actual_widths[0])]
-                                 + [self._get_column_format(actual_widths[k]) for k in range(column_pos, column_end)])
+                line_format = column_format % actual_widths[0] + \
+                    "".join([column_format % width for width in actual_widths[column_pos:column_end]])
 
             if not self.hide_header:
-                output.append(str.format(line_format, *real_header) + (" \\" if column_end != len(headers) else ""))
+                output.append(line_format.format(*real_header) + (" \\" if column_end != len(headers) else ""))
                 output.append("")
 
             # Print body
@@ -310,7 +323,7 @@ class Table:
                         output.append(str.format("{:^%d}" % column_width, "..."))
                         output.append("")
                     else:
-                        output.append(str.format(line_format, *row[column_pos:column_end]))
+                        output.append(line_format.format(*row[column_pos:column_end]))
             else:
                 for row in rows:
                     if row is None:
@@ -321,7 +334,7 @@ class Table:
                         real_row = [row[0]]
                         real_row.extend(row[column_pos:column_end])
 
-                        output.append(str.format(line_format, *real_row))
+                        output.append(line_format.format(*real_row))
 
             column_pos = column_end
 
@@ -375,19 +388,11 @@ def get_representation(value):
         if len(value) == 1:
             return "[%s]" % repr(value[0])
         elif len(value) > 0:
-            all_nodes = True
-            nodetypes = set()
-
-            for elem in value:
-                if isinstance(elem, Node):
-                    nodetypes.add(elem.collection.name)
-                else:
-                    all_nodes = False
-                    break
-
-            if all_nodes:
+            if all(map(isinstance, value, repeat(Node))):
+                nodetypes = {elem.collection.name for elem in value}
                 return "[%d nodes from layer: %s]" % (len(value), ", ".join(nodetypes))
             else:
+                nodetypes = {elem.collection.name for elem in value if isinstance(elem, Node)}
                 return "[%d nodes from %d layers]" % (len(value), len(nodetypes))
         else:
             return "[]"
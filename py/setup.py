@@ -21,6 +21,9 @@ setup(
     author='Marcus Klang',
     author_email='marcus.klang@cs.lth.se',
     install_requires=required,
+    extras_require={
+        'orjson': ['orjson'],
+    },
     url='https://github.com/marcusklang/docria',
     project_urls={
         'Source': 'https://github.com/marcusklang/docria',
@@ -1,6 +1,8 @@
 from docria import Document, DocumentIO
-from docria.model import Text
-from docria.algorithm import span_translate, group_by_span, dominant_right, sequence_to_textspans
+from docria.model import Text, Node
+from docria.algorithm import span_translate, build_span_translator, group_by_span, dominant_right, \
+    sequence_to_textspans, children_of, children_of_precomputed, bfs, dfs, dfs_leaves, bidirectional_bfs, shortest_path, \
+    parent_span_cover, parent_span_overlap, SpanIndex, get_prop
 from docria import T
 
 
@@ -33,6 +35,26 @@ def test_span_remap():
     assert data_layer[3]["raw"].start == 20 and data_layer[3]["raw"].stop == 27
 
 
+def test_span_translator():
+    doc = Document()
+    raw_text = doc.add_text("raw", "0123456789012345678901234567890")
+    clean_text = doc.add_text("clean", "012345012")
+
+    mapping_layer = doc.add_layer("mapping", raw=raw_text.spantype, clean=clean_text.spantype)
+    mapping_layer.add(raw=raw_text[25:27], clean=clean_text[7:9])
+    mapping_layer.add(raw=raw_text[10:15], clean=clean_text[0:5])
+    mapping_layer.add(raw=raw_text[20:22], clean=clean_text[5:7])
+
+    translator = build_span_translator(doc, "mapping", ("raw", "clean"))
+    assert translator.find(0) == 10
+    assert translator.find(5) == 20
+    assert translator.find(8) == 26
+
+    raw_span = translator.translate(clean_text[4:7])
+    assert raw_span.text is raw_text
+    assert raw_span.start == 14 and raw_span.stop == 22
+
+
 def test_group_by():
     doc = Document()
     raw_text = doc.add_text("raw", "0123456789012345678901234567890")
@@ -119,6 +141,189 @@ def test_dominant_right():
     assert 8 in ids
 
 
+def test_parent_span():
+    doc = Document()
+    raw_text = doc.add_text("raw", "0123456789012345678901234567890")
+
+    sentences = doc.add_layer("sentence", text=raw_text.spantype)
+    tokens = doc.add_layer("token", id=T.int32, span=raw_text.spantype)
+
+    sentences.add(text=raw_text[0:6])
+    sentences.add(text=raw_text[6:12])
+
+    tokens.add(id=1, span=raw_text[4:8])
+    tokens.add(id=2, span=raw_text[0:2])
+    tokens.add(id=3, span=raw_text[8:12])
+    tokens.add(id=4, span=raw_text[3:5])
+    tokens.add(id=5)
+
+    covered = parent_span_cover(sentences, tokens, children_span_field="span")
+    assert [[tok["id"] for tok in toks] for _, toks in covered] == [[2, 4], [3]]
+
+    overlapping = parent_span_overlap(sentences, tokens, children_span_field="span")
+    assert [[tok["id"] for tok in toks] for _, toks in overlapping] == [[2, 4, 1], [1, 3]]
+
+    index = SpanIndex(tokens, "span")
+    assert len(index) == 4
+    assert parent_span_overlap(sentences, index) == overlapping
+    assert [tok["id"] for tok in index.covered_by(3, 8)] == [4, 1]
+
+def test_get_prop():
+    node = Node()
+    assert get_prop("x", 1)(node) == 1
+    assert get_prop("x", True)(node) is True
+    assert get_prop("x", 0.0)(node) == 0.0
+    assert get_prop("x", False)(node) is False
+    assert get_prop("x", [])(node) == []
+
+
+def test_children_of():
+    doc = Document()
+    tree = doc.add_layer("tree", head=T.noderef("tree"), children=T.noderef_many("tree"))
+    root, a, b, c = [tree.add() for _ in range(4)]
+    root["children"] = [a, b]
+    a["head"] = root
+    b["children"] = [c]
+    b["head"] = root
+    c["head"] = b
+
+    stored = children_of(tree, "children")(root)
+    assert stored == (a, b)
+    assert stored is not root["children"] and root["children"] == [a, b]
+
+    children = children_of(tree, "children", "head")
+    assert list(children(root)) == [a, b]
+    assert list(children(b)) == [c, root]
+    assert list(children(c)) == [b]
+
+    assert [(depth, n.i) for depth, n in bfs(root, children)] == [(0, 0), (1, 1), (1, 2), (2, 3)]
+    assert [n.i for n in dfs(root, children_of(tree, "children"))] == [0, 1, 2, 3]
+    assert [(depth, n.i) for depth, n in bfs(root, children, max_depth=1)] == [(0, 0), (1, 1), (1, 2)]
+    assert [n.i for n in dfs(root, children_of(tree, "children"), max_depth=1)] == [0, 1, 2]
+    assert [n.i for _, n in bfs(root, children, lambda n: n.i > 0, stop_after_match=True)] == [1]
+    assert [n.i for n in dfs(root, children, lambda n: n.i > 1, stop_after_match=True)] == [2]
+
+    precomputed = children_of_precomputed(tree, "children", "head")
+    assert [precomputed(n) for n in tree] == [tuple(children(n)) for n in tree]
+
+    assert bidirectional_bfs(a, c, children, children) == [a, root, b, c]
+    assert bidirectional_bfs(root, c, children_of(tree, "children"), children_of(tree, "head")) == [root, b, c]
+    assert bidirectional_bfs(c, a, children_of(tree, "children"), children_of(tree, "head")) is None
+
+    weights = {(id(root), id(a)): 1, (id(root), id(b)): 5, (id(a), id(b)): 1}
+    graph = {id(root): [a, b], id(a): [b], id(b): [c], id(c): []}
+    assert shortest_path(root, c, lambda n: graph[id(n)], lambda u, v: weights.get((id(u), id(v)), 1),
+                         parents=lambda n: [n2 for n2 in tree if any(n is ch for ch in graph[id(n2)])]) \
+        == [root, a, b, c]
+    assert shortest_path(root, c, lambda n: graph[id(n)], lambda u, v: weights.get((id(u), id(v)), 1),
+                         heuristic=lambda n: 0) == [root, a, b, c]
+
+
+def test_bidirectional_bfs_directed():
+    doc = Document()
+    tree = doc.add_layer("tree", head=T.noderef("tree"), children=T.noderef_many("tree"))
+    root, a, b, c, d = [tree.add() for _ in range(5)]
+    root["children"] = [a, b]
+    b["children"] = [c]
+    c["children"] = [d]
+    for parent in (root, b, c):
+        for child in parent["children"]:
+            child["head"] = parent
+
+    children, parents = children_of(tree, "children"), children_of(tree, "head")
+    assert bidirectional_bfs(root, c, children, parents) == [root, b, c]
+    assert bidirectional_bfs(root, d, children, parents) == [root, b, c, d]
+    assert bidirectional_bfs(a, d, children, parents) is None
+
+    assert shortest_path(root, d, children) == [root, b, c, d]
+    assert shortest_path(root, d, children, lambda u, v: 2) == [root, b, c, d]
+    assert shortest_path(root, d, children, lambda u, v: 2, parents) == [root, b, c, d]
+    assert shortest_path(a, d, children) is None
+
+
+def test_children_of_precomputed_stale():
+    doc = Document()
+    tree = doc.add_layer("tree", children=T.noderef_many("tree"))
+    root, a, b = [tree.add() for _ in range(3)]
+    root["children"] = [a, b]
+
+    precomputed = children_of_precomputed(tree, "children")
+    assert precomputed(root) == (a, b)
+
+    tree.add()
+    try:
+        precomputed(root)
+        assert False
+    except ValueError:
+        assert True
+
+    precomputed = children_of_precomputed(tree, "children")
+    tree.remove(b)
+    try:
+        precomputed(root)
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_traversal_growing_layer():
+    for search in (lambda start, children: [n for _, n in bfs(start, children)], dfs, dfs_leaves):
+        doc = Document()
+        chain = doc.add_layer("chain", nxt=T.noderef_many("chain"))
+        start = chain.add(nxt=[])
+
+        def children(n):
+            # Nodes are added to the layer while it is being traversed
+            if len(chain) < 5 and len(n["nxt"]) == 0:
+                n["nxt"] = [chain.add(nxt=[])]
+
+            return n["nxt"]
+
+        found = list(search(start, children))
+        assert len(chain) == 5
+        assert [n.i for n in found] == ([4] if search is dfs_leaves else [0, 1, 2, 3, 4])
+
+
+def test_traversal_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    doc = Document()
+    chain = doc.add_layer("chain", nxt=T.noderef_many("chain"))
+    nodes = [chain.add(nxt=[]) for _ in range(200)]
+    for n, nxt in zip(nodes, nodes[1:]):
+        n["nxt"] = [nxt]
+
+    children = children_of(chain, "nxt")
+
+    def walk(k):
+        start = nodes[k % 50]
+        return [n.i for _, n in bfs(start, children)] == list(range(start.i, 200)) and \
+            [n.i for n in dfs(start, children)] == list(range(start.i, 200))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(walk, range(400)))
+
+
+def test_traversal_across_layers():
+    doc = Document()
+    tree = doc.add_layer("tree", children=T.noderef_many("leaf"))
+    leaf = doc.add_layer("leaf", parent=T.noderef("tree"))
+    root = tree.add()
+    a, b = leaf.add(parent=root), leaf.add(parent=root)
+    root["children"] = [a, b]
+
+    def children(n):
+        return n.get("children", []) if n.collection is tree else [n["parent"]]
+
+    assert [(depth, n.collection.name, n.i) for depth, n in bfs(a, children)] == \
+        [(0, "leaf", 0), (1, "tree", 0), (2, "leaf", 1)]
+    assert [(n.collection.name, n.i) for n in dfs(root, children)] == [("tree", 0), ("leaf", 0), ("leaf", 1)]
+    assert [(n.collection.name, n.i) for n in dfs_leaves(a, children)] == [("leaf", 1)]
+
+    dangling = Node()
+    assert [n for _, n in bfs(dangling, lambda n: [dangling])] == [dangling]
+
+
 def test_token_sequence_to_textspans_01():
     sequence = ["A", "B", "C", "D", "E"]
     text = "AB CD. E"
@@ -16,6 +16,7 @@
 #
 from docria.model import Document, DataTypes as T
 from docria.collection import MsgpackDocumentWriter, _BoundaryWriter, _BoundaryReader, MsgpackDocumentReader
+from io import BytesIO
 import re
 import os
 
@@ -49,4 +50,43 @@ def test_io():
 
     os.unlink("test.docria")
 
+
+def test_block_random_access():
+    """Test that documents can be fetched by reference, also within a block being iterated"""
+    output = BytesIO()
+    output.close = lambda: None
+
+    with MsgpackDocumentWriter(output, num_docs_per_block=8) as writer:
+        for i in range(20):
+            doc = Document()
+            doc.add_text("main", "Document number %d. " % i * (i + 1))
+            doc.props["i"] = i
+            writer.write(doc)
+
+    reader = MsgpackDocumentReader(BytesIO(output.getvalue()))
+    refs = [(doc.ref, doc.properties()["i"]) for doc in reader]
+    assert [i for _, i in refs] == list(range(20))
+
+    for ref, i in reversed(refs):
+        assert reader.get(ref).properties()["i"] == i
+
+    reader = MsgpackDocumentReader(BytesIO(output.getvalue()))
+    for _ in range(5):
+        next(reader)
+    assert reader.get(refs[1][0]).properties()["i"] == 1
+
+    with MsgpackDocumentReader(BytesIO(output.getvalue()), prefetch=True) as reader:
+        assert [(doc.ref, doc.properties()["i"]) for doc in reader] == refs
+        assert next(reader, None) is None
+        assert reader.get(refs[3][0]).properties()["i"] == 3
+
+    # Blocks are handed out by the worker while it is active, abandoning iteration must stop it.
+    reader = MsgpackDocumentReader(BytesIO(output.getvalue()), prefetch=True)
+    assert next(reader).properties()["i"] == 0
+    assert [doc.properties()["i"] for _, doc in reader.readblock().documents()] == list(range(8, 16))
+    worker = reader._prefetch_thread
+    del reader
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+
 test_io()
\ No newline at end of file
@@ -14,10 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from docria.model import Document, DataTypes as T, SchemaValidationError, NodeSpan
-from docria.codec import MsgpackCodec, JsonCodec
+from docria.model import Document, DataTypes as T, SchemaValidationError, NodeSpan, ExtData
+from docria.codec import MsgpackCodec, JsonCodec, MsgpackDocumentExt
 import re
 import base64
+import math
 
 
 def test_primary():
@@ -107,6 +108,18 @@ def test_remove():
     assert "in Lund , Sweden" == " ".join(map(lambda n: str(n["text"]), doc["token"]))
 
 
+def test_remove_unordered():
+    doc = create_doc()
+    toks = doc["token"].to_list()
+
+    doc["token"].remove(toks[1])
+    doc["token"].remove(toks[[0, 8]], stable=False)
+    assert "Sweden was written in Lund ," == " ".join(map(lambda n: str(n["text"]), doc["token"]))
+
+    doc["token"].remove(toks[6], stable=False)
+    assert "Sweden was written in Lund" == " ".join(map(lambda n: str(n["text"]), doc["token"]))
+
+
 def test_primary_msgpack():
     """Test basic layer creation and node creation with msgpack serialization roundtrip"""
     doc = MsgpackCodec.decode(MsgpackCodec.encode(test_primary()))
@@ -123,6 +136,34 @@ def test_primary_msgpack():
     assert " ".join(map(str, map(lambda tok: tok["cls"], list(named_entity)))) == "GPE GPE"
 
 
+def test_selective_texts():
+    """Test decoding a subset of texts from a lazily parsed msgpack document"""
+    from docria.codec import MsgpackDocument
+    from io import BytesIO
+
+    doc = create_doc()
+    doc.add_text("other", "Another text")
+    msgdoc = MsgpackDocument(BytesIO(MsgpackCodec.encode(doc)))
+
+    texts = msgdoc.texts("other")
+    assert list(texts.keys()) == ["other"]
+    assert "".join(texts["other"]) == "Another text"
+    assert set(msgdoc.texts().keys()) == {"main", "other"}
+
+
+def test_pickle():
+    """Test pickle roundtrip, including state pickled in the older dict form"""
+    import pickle
+
+    doc = pickle.loads(pickle.dumps(create_doc()))
+    assert str(doc.texts["main"]) == "This code was written in Lund, Sweden."
+    assert " ".join(map(str, doc["token"]["text"])) == "This code was written in Lund , Sweden ."
+
+    legacy = Document.__new__(Document)
+    legacy.__setstate__({"msgpacked": MsgpackCodec.encode(create_doc())})
+    assert len(legacy["token"]) == len(doc["token"])
+
+
 def test_primary_json():
     """Test basic layer creation and node creation with json serialization roundtrip"""
     doc = JsonCodec.decode(JsonCodec.encode(test_primary()))
@@ -137,6 +178,119 @@ def test_primary_json():
     assert " ".join(map(str, map(lambda tok: tok["cls"], list(named_entity)))) == "GPE GPE"
 
 
+def create_typed_doc():
+    doc = create_doc()
+    tokens = doc["token"].to_list()
+
+    typed = doc.add_layer("typed",
+                          i32=T.int32(None), i64=T.int64(None), f64=T.float64(None), flag=T.bool(None),
+                          name=T.string(None), raw=T.binary,
+                          head=T.noderef("token"), tokens=T.noderef_many("token"), span=T.nodespan("token"),
+                          text=doc.texts["main"].spantype)
+
+    typed.add(i32=1, i64=1 << 40, f64=0.5, flag=True, name="first", raw=b"\x00\x01",
+              head=tokens[1], tokens=[tokens[0], tokens[2]], span=NodeSpan(tokens[5], tokens[7]),
+              text=doc.texts["main"][5:9])
+    typed.add(i32=-2, flag=False)
+    typed.add()
+    return doc
+
+
+def check_typed_doc(doc, binary=True):
+    typed = doc["typed"].to_list()
+    assert len(typed) == 3
+
+    first = typed[0]
+    assert first["i32"] == 1 and first["i64"] == 1 << 40 and first["f64"] == 0.5 and first["flag"] is True
+    assert first["name"] == "first"
+    assert not binary or first["raw"] == b"\x00\x01"
+    assert str(first["head"]["text"]) == "code"
+    assert [str(tok["text"]) for tok in first["tokens"]] == ["This", "was"]
+    assert " ".join(str(tok["text"]) for tok in first["span"]) == "Lund , Sweden"
+    assert str(first["text"]) == "code"
+
+    assert typed[1]["i32"] == -2 and typed[1]["flag"] is False and "i64" not in typed[1]
+    assert all(fld not in typed[2] for fld in ("i32", "flag", "head", "tokens", "span", "text"))
+
+
+def test_json_non_finite():
+    doc = Document()
+    doc.props["scale"] = float("inf")
+    values = doc.add_layer("values", f64=T.float64())
+    for v in (float("nan"), float("inf"), -float("inf"), 1.5):
+        values.add(f64=v)
+
+    redoc = JsonCodec.decode(JsonCodec.encode(doc))
+    f64 = [n["f64"] for n in redoc["values"]]
+    assert math.isnan(f64[0]) and f64[1:] == [float("inf"), -float("inf"), 1.5]
+    assert redoc.props["scale"] == float("inf")
+
+
+def test_typed_roundtrip():
+    check_typed_doc(MsgpackCodec.decode(MsgpackCodec.encode(create_typed_doc())))
+
+    doc = create_typed_doc()
+    doc["typed"].remove_field("raw")
+    check_typed_doc(JsonCodec.decode(JsonCodec.encode(doc)), binary=False)
+
+
+def test_packed_columns():
+    doc = create_doc()
+    tokens = doc["token"].to_list()
+    numeric = doc.add_layer("numeric", i32=T.int32(), i64=T.int64(), f64=T.float64(), flag=T.bool(),
+                            head=T.noderef("token"))
+
+    for i, tok in enumerate(tokens):
+        numeric.add(i32=-i, i64=i << 33, f64=i / 4, flag=i % 2 == 0, head=tok)
+
+    redoc = MsgpackCodec.decode(MsgpackCodec.encode(doc, packed_columns=True))
+    for i, n in enumerate(redoc["numeric"]):
+        assert n["i32"] == -i and n["i64"] == i << 33 and n["f64"] == i / 4 and n["flag"] == (i % 2 == 0)
+        assert str(n["head"]["text"]) == str(tokens[i]["text"])
+
+
+def test_dictionary_strings():
+    doc = create_doc()
+    doc.add_layer("pos", tag=T.string(None))
+    tags = ["NN", "VB", None, "NN", "NN", "VB", "DT", "NN"]
+    for tag in tags:
+        doc["pos"].add(tag=tag) if tag is not None else doc["pos"].add()
+
+    data = MsgpackCodec.encode(doc, dictionary_strings=True)
+    assert b"\xa4dict" in data
+
+    redoc = MsgpackCodec.decode(data)
+    assert [n.get("tag") for n in redoc["pos"]] == tags
+
+
+def test_ext_roundtrip():
+    doc = Document()
+    blobs = doc.add_layer("blob", data=T.ext("blob"))
+    blobs.add(data=ExtData("blob", b"abc"))
+    blobs.add(data=ExtData("blob", bytearray(b"xyz")))
+    blobs.add()
+
+    redoc = MsgpackCodec.decode(MsgpackCodec.encode(doc))
+    values = [n.get("data") for n in redoc["blob"]]
+    assert [v.type for v in values[:2]] == ["blob", "blob"]
+    assert [v.data for v in values[:2]] == [b"abc", b"xyz"]
+    assert values[2] is None
+
+
+def test_embedded_doc():
+    doc = Document()
+    doc.add_layer("sub", doc=T.ext("doc"))
+    doc["sub"].add(doc=MsgpackDocumentExt(test_primary()))
+
+    data = MsgpackCodec.encode(doc)
+    redoc = MsgpackCodec.decode(data)
+    embedded = redoc["sub"][0]["doc"]
+    assert isinstance(embedded.data, bytes)
+    assert MsgpackCodec.encode(redoc) == data
+
+    assert str(embedded.decode()["token"][0]["text"]) == "This"
+
+
 def test_java_interaction():
     binary_data = base64.standard_b64decode(
         "RE1fMQGAkqxuYW1lZF9lbnRpdHmldG9rZW4Co2Nsc8Kjc3RypHRleHTDpHNwYW6Bp2NvbnRleHSkbWFpbgGkdGV4dMOkc3BhboGnY29udGV4d"
@@ -168,6 +322,21 @@ def test_schema():
         assert True
 
 
+def test_schema_error_order():
+    doc = Document()
+    layer = doc.add_layer("numbers", a=T.int32(), b=T.int32())
+    first, second = layer.add(), layer.add()
+    first["b"] = "not a number"
+    second["a"] = "not a number"
+
+    # The first invalid node is reported, regardless of field order
+    try:
+        MsgpackCodec.encode(doc)
+        assert False
+    except AssertionError as e:
+        assert "field b" in str(e) and "numbers#0" in str(e)
+
+
 def test_text():
     doc = Document()
     doc.add_text("main", "This code was written in Lund, Sweden")
@@ -219,15 +388,28 @@ def test_field_add():
     from functools import reduce
     assert reduce(lambda x, y: x and y, map(lambda x: "head" not in x, token))
 
+    MsgpackCodec.encode(doc)
     token.add_field("pos", T.string())
     assert reduce(lambda x, y: x and y, map(lambda x: "pos" in x and x["pos"] == "", token))
+    assert "pos" in MsgpackCodec.decode(MsgpackCodec.encode(doc))["token"].schema.fields
 
     token.add_field("is_upper", T.bool())
     assert reduce(lambda x, y: x and y, map(lambda x: "is_upper" in x and x["is_upper"] == False, token))
 
 
 def test_typing():
-    pass
+    assert T.typeof(True) == T.bool()
+    assert T.typeof(1) == T.int64()
+    assert T.typeof(1, T.int32()) == T.int32()
+    assert T.typeof(1 << 40, T.int32()) == T.int64()
+    assert T.typeof(1.0) == T.float64()
+    assert T.typeof("text") == T.string()
+    assert T.typeof(b"data") == T.binary
+
+    doc = create_doc()
+    assert T.typeof(doc["token"][0]) == T.noderef("token")
+    assert T.typeof(doc["token"][0]["text"]) == T.span("main")
+    assert T.typeof(doc["token"].to_list()[0:2]) == T.noderef_many("token")
 
 
 def test_graph():